@@ -0,0 +1,126 @@
+import math
+import time
+import logging
+
+import numpy as np
+
+from data_classes import ExchangeDatastore
+
+log = logging.getLogger('analytics')
+
+SECONDS_PER_HOUR = 3600
+
+
+class MarketSeries:
+    """ Rolling statistics for one venue's market over its last `window`
+    ticker changes, kept in NumPy ring buffers with running sums so every
+    update is O(1).
+
+    Volatility is estimated as the sum of squared log returns over the
+    elapsed time in the window, so irregular polling and skipped unchanged
+    tickers don't bias it. """
+
+    def __init__(self, window, ewma_alpha):
+        self.window = window
+        self.alpha = ewma_alpha
+        self.spreads = np.zeros(window)
+        self.sq_returns = np.zeros(window)
+        self.dts = np.zeros(window)
+        self.spread_sum = 0.0
+        self.sq_return_sum = 0.0
+        self.dt_sum = 0.0
+        self.pos = 0
+        self.count = 0
+        self.updates = 0
+        self.mid = None
+        self.ewma_mid = None
+        self.updated_at = None
+
+    def update(self, bid, last, ask, now):
+        # any consistent unit works, satoshis included
+        mid = (bid + last) / 2
+        if mid <= 0:
+            return
+        spread = (ask - bid) / mid
+        if self.mid is None:
+            sq_return, dt = 0.0, 0.0
+        else:
+            sq_return = math.log(mid / self.mid) ** 2
+            dt = now - self.updated_at
+
+        i = self.pos
+        self.spread_sum += spread - self.spreads[i]
+        self.sq_return_sum += sq_return - self.sq_returns[i]
+        self.dt_sum += dt - self.dts[i]
+        self.spreads[i] = spread
+        self.sq_returns[i] = sq_return
+        self.dts[i] = dt
+        self.pos = (i + 1) % self.window
+        self.count = min(self.count + 1, self.window)
+        self.updates += 1
+        if self.updates % self.window == 0:
+            # wash out floating point drift in the running sums once a lap
+            self.spread_sum = float(self.spreads.sum())
+            self.sq_return_sum = float(self.sq_returns.sum())
+            self.dt_sum = float(self.dts.sum())
+
+        if self.ewma_mid is None:
+            self.ewma_mid = mid
+        else:
+            self.ewma_mid += self.alpha * (mid - self.ewma_mid)
+        self.mid = mid
+        self.updated_at = now
+
+    @property
+    def spread(self):
+        """ Mean relative bid/ask spread over the window """
+        if self.count == 0:
+            return None
+        return self.spread_sum / self.count
+
+    @property
+    def hourly_volatility(self):
+        """ Realized volatility of the midpoint, scaled to one hour """
+        if self.dt_sum <= 0:
+            return None
+        return math.sqrt(max(self.sq_return_sum, 0) / self.dt_sum * SECONDS_PER_HOUR)
+
+
+class AnalyticsPipeline:
+    """ Derived market data fed by ticker updates. Tickers are marked dirty
+    when they change and only dirty markets are recomputed by `process`,
+    which refreshes ExchangeDatastore.midpoints, the conversion rates and the
+    MarketSeries in ExchangeDatastore.analytics. """
+
+    def __init__(self, config):
+        self.config = config
+        self.last_tickers = {}
+        self.dirty = {}
+
+    def on_ticker(self, exchange_name, market, ticker):
+        key = (exchange_name, market)
+        if self.last_tickers.get(key) == ticker:
+            return False
+        self.last_tickers[key] = ticker
+        self.dirty[key] = ticker
+        return True
+
+    def process(self, now=None):
+        now = time.monotonic() if now is None else now
+        for (exchange_name, market), ticker in self.dirty.items():
+            ExchangeDatastore.midpoints.setdefault(exchange_name, {})[
+                market] = (ticker.bid + ticker.last) / 2
+            ExchangeDatastore.rates.on_ticker(exchange_name, market, ticker)
+
+            venue = ExchangeDatastore.analytics.setdefault(exchange_name, {})
+            series = venue.get(market)
+            if series is None:
+                series = venue[market] = MarketSeries(
+                    self.config['window'], self.config['ewma_alpha'])
+            series.update(ticker.bid_sats, ticker.last_sats, ticker.ask_sats, now)
+        processed = len(self.dirty)
+        self.dirty = {}
+        if processed:
+            # once per batch, so rate lookups never pay for a rebuild
+            ExchangeDatastore.rates.refresh()
+        return processed
@@ -0,0 +1,223 @@
+import asyncio
+import copy
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+log = logging.getLogger('gateway')
+
+# Priority classes, lowest value is served first
+CANCEL = 0
+PLACE = 1
+PRIVATE_READ = 2
+PUBLIC_READ = 3
+
+PRIORITY_NAMES = {
+    CANCEL: "cancel",
+    PLACE: "place",
+    PRIVATE_READ: "private_read",
+    PUBLIC_READ: "public_read",
+}
+
+
+class QueueStats:
+    """ Running totals of how long calls of one priority class waited for the
+    rate limit budget, and how many were served by an in-flight twin. """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait):
+        self.calls += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    @property
+    def avg_wait(self):
+        if self.calls == 0:
+            return 0.0
+        return self.total_wait / self.calls
+
+
+class RateBudget:
+    """ Token bucket shared by every user of the exchange API. Waiting callers
+    are served strictly in priority order, so a queued cancel always gets the
+    next token ahead of a queued ticker read. """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.last_refill = time.monotonic()
+        self.cond = threading.Condition()
+        self.waiters = []
+        self.seq = itertools.count()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def acquire(self, priority):
+        """ Block until a token is available and no higher priority caller is
+        waiting. Returns the number of seconds spent queueing. """
+        start = time.monotonic()
+        entry = (priority, next(self.seq))
+        with self.cond:
+            heapq.heappush(self.waiters, entry)
+            try:
+                while True:
+                    self._refill()
+                    if self.waiters[0] == entry and self.tokens >= 1:
+                        break
+                    if self.waiters[0] == entry:
+                        self.cond.wait((1 - self.tokens) / self.rate)
+                    else:
+                        self.cond.wait()
+                heapq.heappop(self.waiters)
+                self.tokens -= 1
+            except BaseException:
+                self.waiters.remove(entry)
+                heapq.heapify(self.waiters)
+                raise
+            finally:
+                self.cond.notify_all()
+        return time.monotonic() - start
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class APIGateway:
+    """ Wraps a QtradeAPI so that every component shares one rate limit
+    budget. Calls are queued by priority class (cancels, then placements,
+    then private reads, then public reads) and identical reads that are
+    already in flight are coalesced into a single request.
+
+    Calls block while they queue, so the bots make them from worker threads
+    (run_in_executor) rather than the event loop; that's also what lets
+    their calls overtake and merge with each other.
+
+    Anything not wrapped here (eg. `markets`) is passed through to the
+    underlying client untouched.
+    """
+
+    def __init__(self, api, config):
+        self.api = api
+        self.config = config
+        self.budget = RateBudget(config['rate_limit'], config['burst'])
+        self.stats = {p: QueueStats() for p in PRIORITY_NAMES}
+        self.inflight = {}
+        self.inflight_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.api, name)
+
+    def _call(self, priority, fn, *args, **kwargs):
+        wait = self.budget.acquire(priority)
+        self.stats[priority].record(wait)
+        if wait > 1:
+            log.debug("%s call %s waited %.2fs for rate limit budget",
+                      PRIORITY_NAMES[priority], fn.__name__, wait)
+        return fn(*args, **kwargs)
+
+    def _single_flight(self, priority, fn, *args, **kwargs):
+        key = (fn.__name__, args, tuple(sorted(
+            (k, repr(v)) for k, v in kwargs.items())))
+        with self.inflight_lock:
+            flight = self.inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.inflight[key] = _Flight()
+
+        if not leader:
+            self.stats[priority].coalesced += 1
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            # Callers like get_orders mutate the response, so don't share it
+            return copy.deepcopy(flight.result)
+
+        try:
+            flight.result = self._call(priority, fn, *args, **kwargs)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.inflight_lock:
+                del self.inflight[key]
+            flight.done.set()
+        return flight.result
+
+    @staticmethod
+    def classify(method, endpoint):
+        if method == 'get':
+            if endpoint.startswith('/v1/user/'):
+                return PRIVATE_READ
+            return PUBLIC_READ
+        if 'cancel' in endpoint:
+            return CANCEL
+        return PLACE
+
+    def get(self, endpoint, *args, **kwargs):
+        return self._single_flight(self.classify('get', endpoint),
+                                   self.api.get, endpoint, *args, **kwargs)
+
+    def post(self, endpoint, *args, **kwargs):
+        return self._call(self.classify('post', endpoint),
+                          self.api.post, endpoint, *args, **kwargs)
+
+    def order(self, *args, **kwargs):
+        return self._call(PLACE, self.api.order, *args, **kwargs)
+
+    def cancel_all_orders(self, *args, **kwargs):
+        return self._call(CANCEL, self.api.cancel_all_orders, *args, **kwargs)
+
+    def cancel_market_orders(self, *args, **kwargs):
+        return self._call(CANCEL, self.api.cancel_market_orders,
+                          *args, **kwargs)
+
+    def orders(self, *args, **kwargs):
+        return self._single_flight(PRIVATE_READ, self.api.orders,
+                                   *args, **kwargs)
+
+    def balances(self, *args, **kwargs):
+        return self._single_flight(PRIVATE_READ, self.api.balances,
+                                   *args, **kwargs)
+
+    def balances_merged(self, *args, **kwargs):
+        return self._single_flight(PRIVATE_READ, self.api.balances_merged,
+                                   *args, **kwargs)
+
+    def headroom(self):
+        """ Fraction of the burst budget currently available """
+        with self.budget.cond:
+            self.budget._refill()
+            return self.budget.tokens / self.budget.burst
+
+    def report(self):
+        for priority, name in PRIORITY_NAMES.items():
+            s = self.stats[priority]
+            log.info("%s: %s calls, %s coalesced, avg queue delay %.3fs, "
+                     "max queue delay %.3fs",
+                     name, s.calls, s.coalesced, s.avg_wait, s.max_wait)
+
+    async def reporter(self):
+        while True:
+            await asyncio.sleep(self.config['report_period'])
+            try:
+                self.report()
+            except Exception:
+                log.warning("Gateway report exploded", exc_info=True)
@@ -0,0 +1,307 @@
+import sys
+import json
+import time
+import random
+import logging
+import statistics
+import tracemalloc
+from collections import Counter
+from decimal import Decimal
+
+import click
+
+from conversion import ConversionGraph
+from data_classes import ExchangeDatastore
+from market_data_collector import MarketDataCollector
+from orderbook_manager import OrderbookManager
+from records import Ticker
+from risk import RiskManager
+
+COIN = Decimal('.00000001')
+
+
+class StubAPI:
+    """ Offline stand-in for QtradeAPI with `n_markets` synthetic <COIN>_BTC
+    markets. Every call is counted so benchmarks can report API calls per
+    cycle alongside timings. """
+
+    def __init__(self, n_markets, levels, seed=1):
+        rng = random.Random(seed)
+        self.calls = Counter()
+        self.coins = ["C{:04d}".format(i) for i in range(n_markets)]
+        self.markets = {}
+        self.prices = {}
+        for i, coin in enumerate(self.coins, start=1):
+            ms = coin + "_BTC"
+            self.markets[ms] = {
+                "id": i,
+                "market_string": ms,
+                "market_currency": {"code": coin},
+                "base_currency": {"code": "BTC"},
+            }
+            self.prices[ms] = Decimal(rng.uniform(1e-7, 1e-2)).quantize(COIN)
+        self.market_info = {
+            m["id"]: {"market_currency": m["market_currency"]["code"],
+                      "base_currency": "BTC"}
+            for m in self.markets.values()}
+        # resting ladder of `levels` orders a side per market
+        self.open_orders = []
+        for ms, price in self.prices.items():
+            for n in range(levels):
+                for order_type, sign in (('buy_limit', -1), ('sell_limit', 1)):
+                    self.open_orders.append({
+                        "id": len(self.open_orders) + 1,
+                        "market_id": self.markets[ms]["id"],
+                        "order_type": order_type,
+                        "open": True,
+                        "price": "{:f}".format(
+                            (price * (1 + sign * Decimal(n + 1) / 100)).quantize(COIN)),
+                        "market_amount_remaining": "10.00000000",
+                    })
+
+        # everything but a sliver above the reserve is out on the books
+        committed = {c: Decimal(0) for c in self.coins}
+        committed["BTC"] = Decimal(0)
+        for o in self.open_orders:
+            if o["order_type"] == 'buy_limit':
+                committed["BTC"] += Decimal(o["price"]) * 10
+            else:
+                committed[self.market_info[o["market_id"]]["market_currency"]] += 10
+        self.bals = {c: str(amt + Decimal('0.00000010'))
+                     for c, amt in committed.items()}
+
+    def tickers(self):
+        return {ms: Ticker.from_prices(p * Decimal('0.99'), p, p * Decimal('1.01'))
+                for ms, p in self.prices.items()}
+
+    def balances_merged(self):
+        self.calls['balances_merged'] += 1
+        return dict(self.bals)
+
+    def get(self, endpoint, **kwargs):
+        self.calls['GET ' + endpoint.rsplit('/', 1)[0]] += 1
+        if endpoint == "/v1/user/orders":
+            # get_orders mutates what it gets back, so hand out copies
+            return {"orders": [dict(o) for o in self.open_orders]}
+        if endpoint.startswith("/v1/market/"):
+            return {"market": self.market_info[int(endpoint.rsplit('/', 1)[1])]}
+        if endpoint == "/v1/currency/BTC":
+            return {"currency": {"config": {"price": "8500.00"}}}
+        if endpoint == "/v1/user/trades":
+            return {"trades": []}
+        raise KeyError(endpoint)
+
+    def post(self, endpoint, **kwargs):
+        self.calls['POST ' + endpoint] += 1
+
+    def order(self, *args, **kwargs):
+        self.calls['order'] += 1
+
+    def cancel_all_orders(self):
+        self.calls['cancel_all_orders'] += 1
+
+    def cancel_market_orders(self, *args, **kwargs):
+        self.calls['cancel_market_orders'] += 1
+
+
+def make_config(api, levels):
+    # round shares down so they never add up to more than 1
+    ladder = {round(0.01 * (n + 1), 4): int(1e6 / levels) / 1e6
+              for n in range(levels)}
+    btc_share = int(1e8 / len(api.markets)) / 1e8
+    markets = {ms: {m["market_currency"]["code"]: .8, "BTC": btc_share}
+               for ms, m in api.markets.items()}
+    markets['default'] = {'intervals': {'buy_limit': ladder,
+                                        'sell_limit': dict(ladder)}}
+    reserves = {c: 0.0000001 for c in api.coins}
+    reserves['BTC'] = 0.0000001
+    return {
+        'markets': markets,
+        'currency_reserves': reserves,
+        'monitor_period': 120,
+        'config_reload_period': 10,
+        'reserve_thresh_usd': 1.00,
+        'price_tolerance': .01,
+        'amount_tolerance': .05,
+        'dry_run_mode': False,
+        'cost_basis_btc': 1.0,
+    }
+
+
+class Case:
+    """ One benchmark fixture: a stubbed api, an OrderbookManager over it, and
+    a populated ExchangeDatastore. """
+
+    def __init__(self, n_markets, levels):
+        self.api = StubAPI(n_markets, levels)
+        ExchangeDatastore.rates = ConversionGraph()
+        # every limit on but out of reach, so checks run and nothing's rejected
+        self.obm = OrderbookManager(
+            self.api, make_config(self.api, levels), risk=RiskManager({
+                'max_market_notional_btc': 1e6, 'max_total_notional_btc': 1e6,
+                'max_currency_exposure': {'BTC': 1e6}, 'max_orders_per_sec': 1e6,
+                'max_drawdown': 1}))
+        self.mdc = MarketDataCollector({
+            'scrapers': {}, 'update_period': 1,
+            'scheduler': {'min_interval': 1, 'max_interval': 1},
+            'analytics': {'window': 256, 'ewma_alpha': 0.1}})
+        ExchangeDatastore.tickers.clear()
+        ExchangeDatastore.midpoints.clear()
+        ExchangeDatastore.tickers['qtrade'] = self.api.tickers()
+        ExchangeDatastore.tickers['bittrex'] = self.api.tickers()
+        for venue, tickers in ExchangeDatastore.tickers.items():
+            for ms, ticker in tickers.items():
+                self.mdc.analytics.on_ticker(venue, ms, ticker)
+        self.mdc.update_midpoints()
+
+        self.allocs = self.obm.compute_allocations()
+        self.ladders = {ms: self.obm.allocate_orders(m, b, ms)
+                        for ms, (m, b) in self.allocs.items()}
+        self.profile = {}
+        for ms, ladder in self.ladders.items():
+            t = ExchangeDatastore.tickers['bittrex'][ms]
+            self.profile[ms] = self.obm.price_orders(ladder, t.bid, t.ask)
+        self.orders = self.obm.get_orders()
+
+    def compute_allocations(self):
+        self.obm.compute_allocations()
+
+    def allocate_orders(self):
+        for ms, (m, b) in self.allocs.items():
+            self.obm.allocate_orders(m, b, ms)
+
+    def price_orders(self):
+        for ms, ladder in self.ladders.items():
+            t = ExchangeDatastore.tickers['bittrex'][ms]
+            self.obm.price_orders(ladder, t.bid, t.ask)
+
+    def check_for_rebalance(self):
+        # steady state: nothing moved since the last rebalance
+        self.obm.prev_alloc_profile = self.profile
+        self.obm.check_for_rebalance(self.profile, self.orders)
+
+    def get_orders(self):
+        self.obm.get_orders()
+
+    def update_midpoints(self):
+        # one ticker in a hundred changed since the last cycle
+        tickers = ExchangeDatastore.tickers['bittrex']
+        for ms in list(tickers)[::100]:
+            t = tickers[ms]
+            tickers[ms] = t._replace(last_sats=t.last_sats + 1)
+            self.mdc.analytics.on_ticker('bittrex', ms, tickers[ms])
+        self.mdc.update_midpoints()
+
+    def estimate_account_value(self):
+        self.obm.estimate_account_value()
+
+    def generate_orders(self):
+        self.obm.prev_alloc_profile = dict(self.profile)
+        self.obm.generate_orders()
+
+    def generate_orders_one_moved(self):
+        # a single market's quote moves past the price tolerance
+        self.obm.prev_alloc_profile = dict(self.profile)
+        tickers = ExchangeDatastore.tickers['bittrex']
+        ms = next(iter(self.profile))
+        tickers[ms] = tickers[ms]._replace(
+            bid_sats=tickers[ms].bid_sats * 105 // 100,
+            ask_sats=tickers[ms].ask_sats * 105 // 100)
+        self.obm.generate_orders()
+
+
+BENCHMARKS = ['compute_allocations', 'allocate_orders', 'price_orders',
+              'check_for_rebalance', 'get_orders', 'update_midpoints',
+              'estimate_account_value',
+              'generate_orders', 'generate_orders_one_moved']
+
+
+def run_bench(case, name, repeat):
+    fn = getattr(case, name)
+    fn()  # warm up
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    case.api.calls.clear()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'median_ms': statistics.median(times) * 1000,
+        'min_ms': min(times) * 1000,
+        'peak_kib': peak / 1024,
+        'api_calls': sum(case.api.calls.values()),
+    }
+
+
+def parse_ints(ctx, param, value):
+    return [int(v) for v in value.split(',')]
+
+
+@click.command()
+@click.option('--markets', '-m', default="4,50,500,5000", callback=parse_ints,
+              help='comma separated market counts')
+@click.option('--levels', '-l', default="5,50", callback=parse_ints,
+              help='comma separated ladder levels per side')
+@click.option('--bench', '-b', multiple=True, type=click.Choice(BENCHMARKS),
+              help='only run these benchmarks')
+@click.option('--repeat', '-r', default=5)
+@click.option('--baseline', default="bench_baseline.json", type=click.Path())
+@click.option('--save', default=False, is_flag=True, help='write results as the new baseline')
+@click.option('--tolerance', default=0.25, help='allowed slowdown before flagging a regression')
+@click.option('--metric', default='min', type=click.Choice(['min', 'median']),
+              help='timing compared against the baseline; min is the least noisy for short runs')
+def main(markets, levels, bench, repeat, baseline, save, tolerance, metric):
+    # keep log I/O out of the timings
+    logging.disable(logging.CRITICAL)
+
+    try:
+        with open(baseline) as f:
+            previous = json.load(f)
+    except FileNotFoundError:
+        previous = {}
+
+    results = {}
+    regressions = []
+    print("{:<26} {:>6} {:>6} {:>11} {:>11} {:>11} {:>9}  {}".format(
+        'benchmark', 'mkts', 'levels', 'median ms', 'min ms', 'peak KiB',
+        'api calls', 'vs baseline'))
+    for n_markets in markets:
+        for n_levels in levels:
+            case = Case(n_markets, n_levels)
+            for name in bench or BENCHMARKS:
+                key = "{}/{}/{}".format(name, n_markets, n_levels)
+                r = results[key] = run_bench(case, name, repeat)
+
+                note = ''
+                base = previous.get(key)
+                if base is not None:
+                    stat = metric + '_ms'
+                    ratio = r[stat] / base[stat] if base[stat] else 1
+                    note = "x{:.2f}".format(ratio)
+                    if ratio > 1 + tolerance or r['api_calls'] > base['api_calls']:
+                        note += " REGRESSION"
+                        regressions.append(key)
+                print("{:<26} {:>6} {:>6} {:>11.3f} {:>11.3f} {:>11.1f} {:>9}  {}".format(
+                    name, n_markets, n_levels, r['median_ms'], r['min_ms'],
+                    r['peak_kib'], r['api_calls'], note))
+
+    if save:
+        previous.update(results)
+        with open(baseline, 'w') as f:
+            json.dump(previous, f, indent=2, sort_keys=True)
+        print("Saved baseline to", baseline)
+
+    if regressions:
+        print("{} regressions against {}".format(len(regressions), baseline))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
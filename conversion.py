@@ -0,0 +1,115 @@
+import logging
+import threading
+from decimal import Decimal
+
+from records import Ticker, from_sats
+
+log = logging.getLogger('conversion')
+
+
+class ConversionGraph:
+    """ Conversion rates between currencies, built from every venue's
+    tickers. A MARKET_BASE ticker gives two edges: selling MARKET into its
+    bid, and buying MARKET at its ask with BASE.
+
+    The best rate (most value out per unit in) from every currency to each
+    of `targets`, over paths of at most `max_hops` markets, is recomputed by
+    `refresh` after tickers that feed an edge changed. The collector calls
+    that once per batch of tickers, so lookups (including the ones on the
+    risk check's order path) are a dict read and never rebuild anything.
+    Writers go through `lock`, since the collector feeds it on the event
+    loop while orderbook manager cycles pin rates from a worker thread. """
+
+    def __init__(self, targets=('BTC', 'USD'), max_hops=3):
+        self.targets = targets
+        self.max_hops = max_hops
+        # (venue, market) -> (market_currency, base_currency, bid, ask)
+        self.quotes = {}
+        # {target: {coin: (rate, path)}}
+        self.best = {}
+        self.dirty = True
+        self.rebuilds = 0
+        self.lock = threading.Lock()
+
+    def on_ticker(self, venue, market, ticker):
+        """ Feed a MARKET_BASE ticker; returns True if it moved an edge """
+        try:
+            market_currency, base_currency = market.split('_')
+        except ValueError:
+            return False
+        quote = (market_currency, base_currency, ticker.bid_sats, ticker.ask_sats)
+        with self.lock:
+            if self.quotes.get((venue, market)) == quote:
+                return False
+            self.quotes[(venue, market)] = quote
+            self.dirty = True
+        return True
+
+    def set_rate(self, coin, base, rate, venue='manual'):
+        """ Pin a rate that doesn't come from a scraped market, eg. an
+        exchange's own BTC price in USD; takes effect straight away """
+        moved = self.on_ticker(venue, coin + '_' + base,
+                               Ticker.from_prices(rate, rate, rate))
+        self.refresh()
+        return moved
+
+    def edges(self):
+        """ Best rate for each directed (from, to) pair across all venues """
+        edges = {}
+        for (venue, market), (mc, bc, bid, ask) in self.quotes.items():
+            for src, dst, rate in ((mc, bc, from_sats(bid)),
+                                   (bc, mc, 1 / from_sats(ask) if ask > 0 else 0)):
+                if rate > 0 and rate > edges.get((src, dst), (0,))[0]:
+                    edges[(src, dst)] = (rate, venue + ':' + market)
+        return edges
+
+    def refresh(self):
+        """ Rebuild the best rates if a ticker moved since the last one """
+        with self.lock:
+            if self.dirty:
+                self.rebuild()
+
+    def rebuild(self):
+        edges = self.edges()
+        best = {}
+        for target in self.targets:
+            # Bellman-Ford bounded to max_hops, which also keeps cross-venue
+            # arbitrage loops from running away
+            paths = {target: (Decimal(1), ())}
+            for _ in range(self.max_hops):
+                nxt = dict(paths)
+                for (src, dst), (rate, via) in edges.items():
+                    if dst not in paths or src == target:
+                        continue
+                    dst_rate, dst_path = paths[dst]
+                    cand = rate * dst_rate
+                    if src not in nxt or cand > nxt[src][0]:
+                        nxt[src] = (cand, (via,) + dst_path)
+                if nxt == paths:
+                    break
+                paths = nxt
+            best[target] = paths
+        self.best = best
+        self.dirty = False
+        self.rebuilds += 1
+
+    def lookup(self, coin, target):
+        # rebuild swaps in a whole new `best`, so this needs no lock
+        return self.best.get(target, {}).get(coin)
+
+    def rate(self, coin, target='BTC'):
+        """ Value of one `coin` in `target`, or None if there's no path """
+        found = self.lookup(coin, target)
+        return None if found is None else found[0]
+
+    def path(self, coin, target='BTC'):
+        """ The venue:market hops behind `rate`, eg. ('qtrade:XYZ_ETH',
+        'bittrex:ETH_BTC') """
+        found = self.lookup(coin, target)
+        return None if found is None else found[1]
+
+    def convert(self, coin, amt, target='BTC'):
+        rate = self.rate(coin, target)
+        if rate is None:
+            return None
+        return Decimal(amt) * rate
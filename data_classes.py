@@ -1,3 +1,6 @@
+from conversion import ConversionGraph
+
+
 class ExchangeDatastore:
     midpoints = {
 
@@ -5,6 +8,16 @@ class ExchangeDatastore:
     tickers = {
 
     }
+    # seconds between polls chosen by the PollScheduler, by venue and market
+    poll_intervals = {
+
+    }
+    # analytics.MarketSeries rolling stats, by venue and market
+    analytics = {
+
+    }
+    # best conversion rates to BTC and USD across every venue's tickers
+    rates = ConversionGraph()
 
 
 class PrivateDatastore:
@@ -0,0 +1,516 @@
+import sys
+import re
+import json
+import time
+import random
+import threading
+import logging as log
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import click
+import yaml
+
+COIN = Decimal('.00000001')
+
+
+class SimError(Exception):
+
+    def __init__(self, status, code, title=None):
+        self.status = status
+        self.code = code
+        self.title = title or code
+        super().__init__(title)
+
+
+def fmt(d):
+    return '{:f}'.format(Decimal(d).quantize(COIN))
+
+
+class SimOrder:
+
+    def __init__(self, id, market, order_type, price, amount):
+        self.id = id
+        self.market = market
+        self.order_type = order_type
+        self.price = price
+        self.market_amount = amount
+        self.market_amount_remaining = amount
+        self.open = True
+        self.created_at = time.time()
+        self.trades = []
+
+    def to_json(self):
+        return {
+            "id": self.id,
+            "market_id": self.market.id,
+            "market_string": self.market.market_string,
+            "order_type": self.order_type,
+            "price": fmt(self.price),
+            "market_amount": fmt(self.market_amount),
+            "market_amount_remaining": fmt(self.market_amount_remaining),
+            "base_amount": fmt(self.price * self.market_amount),
+            "open": self.open,
+            "created_at": self.created_at,
+            "trades": self.trades,
+        }
+
+
+class SimMarket:
+
+    def __init__(self, id, market_string, ref_price):
+        self.id = id
+        self.market_string = market_string
+        self.market_currency, self.base_currency = market_string.split('_')
+        self.ref_price = Decimal(ref_price)
+        self.last_price = self.ref_price
+        # resting orders, kept sorted best price first then by time
+        self.bids = []
+        self.asks = []
+
+    def to_json(self):
+        return {
+            "id": self.id,
+            "market_string": self.market_string,
+            "market_currency": self.market_currency,
+            "base_currency": self.base_currency,
+            "can_trade": True,
+            "can_cancel": True,
+            "can_view": True,
+        }
+
+    def rest(self, order):
+        if order.order_type == 'buy_limit':
+            self.bids.append(order)
+            self.bids.sort(key=lambda o: (-o.price, o.id))
+        else:
+            self.asks.append(order)
+            self.asks.sort(key=lambda o: (o.price, o.id))
+
+    def unrest(self, order):
+        book = self.bids if order.order_type == 'buy_limit' else self.asks
+        if order in book:
+            book.remove(order)
+
+
+class SimExchange:
+    """ In-memory stand-in for the qTrade exchange. Holds a single account,
+    a price-time priority book per market, and a synthetic taker flow that
+    walks each market's reference price and fills resting orders that it
+    reaches. """
+
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.RLock()
+        self.rng = random.Random(config.get('seed'))
+        self.markets = {}
+        for i, (ms, price) in enumerate(config['markets'].items(), start=1):
+            self.markets[ms] = SimMarket(i, ms, price)
+        self.markets_by_id = {m.id: m for m in self.markets.values()}
+        self.usd_prices = {c: Decimal(p)
+                           for c, p in config['usd_prices'].items()}
+        self.balances = {c: Decimal(b) for c, b in config['balances'].items()}
+        self.order_balances = {c: Decimal(0) for c in self.balances}
+        self.orders = {}
+        self.trades = []
+        self.next_order_id = 1
+        self.next_trade_id = 1
+
+    def currencies(self):
+        codes = set(self.balances)
+        for m in self.markets.values():
+            codes.update((m.market_currency, m.base_currency))
+        return sorted(codes)
+
+    def get_market(self, ident):
+        if ident.isdigit() and int(ident) in self.markets_by_id:
+            return self.markets_by_id[int(ident)]
+        if ident in self.markets:
+            return self.markets[ident]
+        raise SimError(404, 'not_found', 'Market not found')
+
+    def ticker(self, market):
+        spread = Decimal(str(self.config['spread']))
+        bid = market.bids[0].price if market.bids else \
+            market.ref_price * (1 - spread)
+        ask = market.asks[0].price if market.asks else \
+            market.ref_price * (1 + spread)
+        return {
+            "id": market.id,
+            "id_hr": market.market_string,
+            "bid": fmt(bid),
+            "ask": fmt(ask),
+            "last": fmt(market.last_price),
+            "day_open": fmt(market.ref_price),
+        }
+
+    def orderbook(self, market):
+        def aggregate(book):
+            levels = {}
+            for o in book:
+                p = fmt(o.price)
+                levels[p] = levels.get(p, Decimal(0)) + \
+                    o.market_amount_remaining
+            return {p: fmt(a) for p, a in levels.items()}
+        return {"buy": aggregate(market.bids), "sell": aggregate(market.asks),
+                "last_change": int(time.time() * 1000)}
+
+    def _move(self, coin, amount, hold):
+        """ Move `amount` of `coin` between the free and order balances.
+        Positive `hold` locks funds, negative releases them. """
+        self.balances.setdefault(coin, Decimal(0))
+        self.order_balances.setdefault(coin, Decimal(0))
+        self.balances[coin] -= amount * hold
+        self.order_balances[coin] += amount * hold
+
+    def place_order(self, order_type, body):
+        market = self.get_market(str(body.get('market_id', '')))
+        price = Decimal(str(body['price'])).quantize(COIN)
+        if price <= 0:
+            raise SimError(400, 'invalid_price')
+        if body.get('amount') is not None:
+            amount = Decimal(str(body['amount'])).quantize(COIN)
+        elif body.get('value') is not None:
+            amount = (Decimal(str(body['value'])) / price).quantize(COIN)
+        else:
+            raise SimError(400, 'missing_amount')
+        if amount <= 0:
+            raise SimError(400, 'invalid_amount')
+
+        crosses = (market.asks and price >= market.asks[0].price) \
+            if order_type == 'buy_limit' else \
+            (market.bids and price <= market.bids[0].price)
+        if crosses and body.get('prevent_taker'):
+            raise SimError(400, 'prevent_taker', 'Order would be a taker')
+
+        if order_type == 'buy_limit':
+            coin, needed = market.base_currency, (amount * price).quantize(COIN)
+        else:
+            coin, needed = market.market_currency, amount
+        if self.balances.get(coin, Decimal(0)) < needed:
+            raise SimError(400, 'insufficient_funds')
+
+        order = SimOrder(self.next_order_id, market, order_type, price, amount)
+        self.next_order_id += 1
+        self.orders[order.id] = order
+        self._move(coin, needed, 1)
+
+        book = market.asks if order_type == 'buy_limit' else market.bids
+        for resting in list(book):
+            if order.market_amount_remaining <= 0:
+                break
+            if order_type == 'buy_limit' and resting.price > price:
+                break
+            if order_type == 'sell_limit' and resting.price < price:
+                break
+            fill = min(resting.market_amount_remaining,
+                       order.market_amount_remaining)
+            self.fill(resting, fill, taker=False)
+            self.fill(order, fill, taker=True, price=resting.price)
+        if order.open:
+            market.rest(order)
+        return order
+
+    def fill(self, order, amount, taker, price=None):
+        market = order.market
+        price = order.price if price is None else price
+        base = (amount * price).quantize(COIN)
+        if order.order_type == 'buy_limit':
+            # release the hold at the order price, pay at the fill price
+            self._move(market.base_currency, (amount * order.price).quantize(COIN), -1)
+            self.balances[market.base_currency] -= base
+            self.balances[market.market_currency] = self.balances.get(
+                market.market_currency, Decimal(0)) + amount
+            side = 'buy'
+        else:
+            self._move(market.market_currency, amount, -1)
+            self.balances[market.market_currency] -= amount
+            self.balances[market.base_currency] = self.balances.get(
+                market.base_currency, Decimal(0)) + base
+            side = 'sell'
+        trade = {
+            "id": self.next_trade_id,
+            "order_id": order.id,
+            "market_id": market.id,
+            "market_string": market.market_string,
+            "side": side,
+            "taker": taker,
+            "price": fmt(price),
+            "market_amount": fmt(amount),
+            "base_amount": fmt(base),
+            "base_fee": fmt(0),
+            "created_at": time.time(),
+        }
+        self.next_trade_id += 1
+        self.trades.append(trade)
+        order.trades.append(trade)
+        order.market_amount_remaining -= amount
+        market.last_price = price
+        if order.market_amount_remaining <= 0:
+            self.close_order(order)
+
+    def close_order(self, order):
+        if not order.open:
+            return
+        order.open = False
+        order.market.unrest(order)
+        remaining = order.market_amount_remaining
+        if remaining <= 0:
+            return
+        if order.order_type == 'buy_limit':
+            self._move(order.market.base_currency,
+                       (remaining * order.price).quantize(COIN), -1)
+        else:
+            self._move(order.market.market_currency, remaining, -1)
+
+    def cancel_order(self, id):
+        order = self.orders.get(int(id))
+        if order is None:
+            raise SimError(404, 'not_found', 'Order not found')
+        if not order.open:
+            raise SimError(400, 'order_not_open')
+        self.close_order(order)
+
+    def cancel_all(self):
+        for order in list(self.orders.values()):
+            self.close_order(order)
+
+    def step(self):
+        """ Random walk every reference price, then send a synthetic taker
+        order that sweeps resting orders within `taker_reach` of it. """
+        vol = self.config['volatility']
+        reach = Decimal(str(self.config['taker_reach']))
+        for market in self.markets.values():
+            drift = Decimal(str(self.rng.gauss(0, vol)))
+            market.ref_price = max(
+                (market.ref_price * (1 + drift)).quantize(COIN), COIN)
+            if self.rng.random() > self.config['taker_rate']:
+                continue
+            size = Decimal(str(self.rng.uniform(0, self.config['taker_size'])))
+            if self.rng.random() < 0.5:
+                book, limit = market.bids, market.ref_price * (1 - reach)
+                reached = lambda o: o.price >= limit
+            else:
+                book, limit = market.asks, market.ref_price * (1 + reach)
+                reached = lambda o: o.price <= limit
+            for order in list(book):
+                if size <= 0 or not reached(order):
+                    break
+                notional = order.market_amount_remaining * order.price
+                if notional <= size:
+                    fill = order.market_amount_remaining
+                else:
+                    fill = (size / order.price).quantize(COIN)
+                if fill <= 0:
+                    break
+                size -= fill * order.price
+                self.fill(order, fill, taker=False)
+
+    def route(self, method, path, query, body):
+        """ Returns the `data` payload for a request, raising SimError for
+        anything the real API would reject. """
+        routes = [
+            ('GET', r'/v1/common', lambda: {
+                "currencies": [self.currency(c) for c in self.currencies()],
+                "markets": [m.to_json() for m in self.markets.values()],
+                "tickers": [self.ticker(m) for m in self.markets.values()]}),
+            ('GET', r'/v1/markets', lambda: {
+                "markets": [m.to_json() for m in self.markets.values()]}),
+            ('GET', r'/v1/market/(?P<m>\w+)', lambda m: {
+                "market": self.get_market(m).to_json()}),
+            ('GET', r'/v1/ticker/(?P<m>\w+)', lambda m: self.ticker(
+                self.get_market(m))),
+            ('GET', r'/v1/orderbook/(?P<m>\w+)', lambda m: self.orderbook(
+                self.get_market(m))),
+            ('GET', r'/v1/currency/(?P<c>\w+)', lambda c: {
+                "currency": self.currency(c)}),
+            ('GET', r'/v1/user/balances', lambda: {
+                "balances": self.balance_list(self.balances)}),
+            ('GET', r'/v1/user/balances_all', lambda: {
+                "balances": self.balance_list(self.balances),
+                "order_balances": self.balance_list(self.order_balances)}),
+            ('GET', r'/v1/user/orders', lambda: {
+                "orders": self.order_list(query.get('open'))}),
+            ('GET', r'/v1/user/order/(?P<id>\d+)', lambda id: {
+                "order": self.get_order(id).to_json()}),
+            ('GET', r'/v1/user/trades', lambda: {
+                "trades": self.trade_list(query.get('newer_than'))}),
+            ('POST', r'/v1/user/(?P<t>buy_limit|sell_limit)', lambda t: {
+                "order": self.place_order(t, body).to_json()}),
+            ('POST', r'/v1/user/cancel_order', lambda: self.cancel_order(
+                body.get('id', 0))),
+            ('POST', r'/v1/user/cancel_all', lambda: self.cancel_all()),
+        ]
+        for route_method, pattern, handler in routes:
+            match = re.fullmatch(pattern, path)
+            if route_method == method and match:
+                with self.lock:
+                    return handler(**match.groupdict())
+        raise SimError(404, 'not_found', 'No such endpoint')
+
+    def currency(self, code):
+        if code not in self.currencies():
+            raise SimError(404, 'not_found', 'Currency not found')
+        price = self.usd_prices.get(code)
+        if price is None:
+            # value everything else through its BTC market
+            m = self.markets.get(code + '_BTC')
+            price = m.ref_price * self.usd_prices['BTC'] if m else Decimal(0)
+        return {"code": code, "long_name": code, "precision": 8,
+                "status": "ok", "config": {"price": '{:f}'.format(price)}}
+
+    def balance_list(self, balances):
+        return [{"currency": c, "balance": fmt(b)}
+                for c, b in balances.items() if b != 0]
+
+    def get_order(self, id):
+        order = self.orders.get(int(id))
+        if order is None:
+            raise SimError(404, 'not_found', 'Order not found')
+        return order
+
+    def order_list(self, open_filter):
+        orders = self.orders.values()
+        if open_filter is not None:
+            want = open_filter.lower() == 'true'
+            orders = [o for o in orders if o.open == want]
+        return [o.to_json() for o in orders]
+
+    def trade_list(self, newer_than):
+        newer_than = int(newer_than or 0)
+        trades = [t for t in self.trades if t['id'] > newer_than]
+        # the real API pages results, which trade_scraper relies on
+        return trades[:self.config['page_size']]
+
+
+class RateLimiter:
+    """ Non-blocking token bucket; requests over budget are answered with a
+    429 like the real API does. """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class SimRequestHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        log.debug("%s - %s", self.address_string(), format % args)
+
+    def respond(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_request(self, method):
+        sim = self.server.sim
+        cfg = sim.config
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        body = {}
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            try:
+                body = json.loads(self.rfile.read(length))
+            except ValueError:
+                return self.respond(400, {"errors": [
+                    {"code": "invalid_json", "title": "Invalid JSON"}]})
+
+        time.sleep(max(0, sim.rng.gauss(cfg['latency'], cfg['latency_jitter'])))
+        if not self.server.limiter.allow():
+            return self.respond(429, {"errors": [
+                {"code": "too_many_requests", "title": "Rate limited"}]})
+        if sim.rng.random() < cfg['error_rate']:
+            return self.respond(500, {"errors": [
+                {"code": "internal_error", "title": "Injected error"}]})
+        try:
+            data = sim.route(method, url.path, query, body)
+        except SimError as e:
+            return self.respond(e.status, {"errors": [
+                {"code": e.code, "title": e.title}]})
+        except (KeyError, ValueError, ArithmeticError) as e:
+            return self.respond(400, {"errors": [
+                {"code": "bad_request", "title": str(e)}]})
+        self.respond(200, {"data": data})
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+
+def make_server(config, host='127.0.0.1', port=None):
+    """ Build a simulator HTTP server. Pass port=0 to bind a free port, eg.
+    for in-process integration tests. """
+    server = ThreadingHTTPServer(
+        (host, config['port'] if port is None else port), SimRequestHandler)
+    server.daemon_threads = True
+    server.sim = SimExchange(config)
+    server.limiter = RateLimiter(config['rate_limit'], config['burst'])
+    return server
+
+
+def run_market(sim, stop):
+    while not stop.wait(sim.config['tick_period']):
+        with sim.lock:
+            try:
+                sim.step()
+            except Exception:
+                log.warning("Simulator step exploded", exc_info=True)
+
+
+@click.command()
+@click.option('--config', '-c', default="config.yml", type=click.File())
+@click.option('--host', '-h', default="127.0.0.1")
+@click.option('--port', '-p', default=None, type=int, help='overrides config port')
+@click.option('--verbose', '-v', default=False, is_flag=True)
+def main(config, host, port, verbose):
+    log_level = "DEBUG" if verbose is True else "INFO"
+
+    root = log.getLogger()
+    root.setLevel(log_level)
+    handler = log.StreamHandler(sys.stdout)
+    handler.setLevel(log_level)
+    formatter = log.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    handler.setFormatter(formatter)
+    root.addHandler(handler)
+
+    config = yaml.safe_load(config)['exchange_sim']
+    server = make_server(config, host, port)
+    stop = threading.Event()
+    threading.Thread(target=run_market, args=(server.sim, stop),
+                     daemon=True).start()
+    host, port = server.server_address[:2]
+    log.info("Exchange simulator listening; run the bot with -e http://%s:%s",
+             host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
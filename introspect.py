@@ -0,0 +1,269 @@
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import asyncio
+import logging
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+
+log = logging.getLogger('introspect')
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class StageTimes:
+    """ Durations of the most recent bot stages, eg. obm.get_orders or
+    mdc.poll, for finding what made a cycle slow. Timing a stage costs two
+    perf_counter calls and a deque append. """
+
+    def __init__(self, keep=500):
+        self.recent = deque(maxlen=keep)
+        self.totals = {}
+
+    @contextmanager
+    def time(self, name, detail=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, detail)
+
+    def add(self, name, seconds, detail=None):
+        self.recent.append((name, detail, seconds, time.time()))
+        total = self.totals.get(name)
+        if total is None:
+            self.totals[name] = [1, seconds, seconds]
+        else:
+            total[0] += 1
+            total[1] += seconds
+            total[2] = max(total[2], seconds)
+
+    def slowest(self, n=10):
+        return [{'stage': name, 'detail': detail, 'seconds': seconds, 'at': at}
+                for name, detail, seconds, at in
+                sorted(self.recent, key=lambda r: r[2], reverse=True)[:n]]
+
+    def summary(self):
+        return {name: {'count': count, 'mean': total / count, 'max': worst}
+                for name, (count, total, worst) in sorted(self.totals.items())}
+
+
+# shared by the orderbook manager and market data collector
+stages = StageTimes()
+
+
+class LoopLag:
+    """ How late the event loop wakes a sleeping task; anything blocking the
+    loop (a slow stage, a synchronous API call) shows up here """
+
+    def __init__(self, interval, keep=120):
+        self.interval = interval
+        self.samples = deque(maxlen=keep)
+
+    async def watch(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(loop.time() - start - self.interval, 0))
+
+    def summary(self):
+        if not self.samples:
+            return None
+        return {'last': self.samples[-1], 'max': max(self.samples),
+                'mean': sum(self.samples) / len(self.samples),
+                'window_seconds': len(self.samples) * self.interval}
+
+
+def frame_name(frame):
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return "{}:{}".format(module, code.co_name)
+
+
+class SamplingProfiler:
+    """ Samples the stacks of every thread running bot code (the event loop,
+    and eg. an orderbook manager cycle on a worker thread) from a background
+    thread every `interval` seconds while running. Output is in the
+    collapsed stack format that flamegraph.pl, speedscope and inferno read,
+    rooted at the thread name:
+    `MainThread;main:run;orderbook_manager:monitor;... <samples>` """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.counts = Counter()
+        self.samples = 0
+        self.started = None
+        self.stopping = threading.Event()
+        self.thread = None
+        # co_filename -> whether it's one of the bot's own modules
+        self.ours = {}
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self):
+        if self.running:
+            return False
+        self.counts = Counter()
+        self.samples = 0
+        self.started = time.time()
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.sample, name='profiler',
+                                       daemon=True)
+        self.thread.start()
+        return True
+
+    def is_ours(self, filename):
+        ours = self.ours.get(filename)
+        if ours is None:
+            ours = self.ours[filename] = os.path.dirname(
+                os.path.abspath(filename)) == HERE
+        return ours
+
+    def sample(self):
+        me = threading.get_ident()
+        while not self.stopping.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                ours = False
+                while frame is not None:
+                    ours = ours or self.is_ours(frame.f_code.co_filename)
+                    stack.append(frame_name(frame))
+                    frame = frame.f_back
+                # idle pool threads are all library frames
+                if not ours:
+                    continue
+                stack.append(names.get(ident, str(ident)))
+                stack.reverse()
+                self.counts[';'.join(stack)] += 1
+            self.samples += 1
+
+    def stop(self):
+        if not self.running:
+            return False
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+        return True
+
+    def folded(self):
+        return ''.join("{} {}\n".format(stack, n)
+                       for stack, n in self.counts.most_common())
+
+
+def task_states():
+    tasks = []
+    for task in asyncio.all_tasks():
+        if task.cancelled():
+            state = 'cancelled'
+        elif task.done():
+            state = 'done'
+        else:
+            state = 'pending'
+        # innermost frame is where the task is waiting
+        stack = task.get_stack()
+        where = None
+        if stack:
+            where = "{}:{}".format(frame_name(stack[-1]), stack[-1].f_lineno)
+        tasks.append({'name': task.get_name(), 'state': state,
+                      'coro': getattr(task.get_coro(), '__qualname__', None),
+                      'waiting_at': where})
+    return sorted(tasks, key=lambda t: t['name'])
+
+
+class Introspector:
+    """ Runtime introspection for the `run` loop, served as one JSON request
+    and reply per connection on a local unix socket (see `main.py
+    introspect`). SIGUSR1 also toggles the profiler, writing the folded
+    stacks to `dump_dir` when it stops. """
+
+    def __init__(self, config):
+        self.config = config
+        self.lag = LoopLag(config['lag_interval'])
+        self.profiler = None
+
+    async def serve(self):
+        loop = asyncio.get_event_loop()
+        self.profiler = SamplingProfiler(self.config['sample_interval'])
+        try:
+            loop.add_signal_handler(signal.SIGUSR1, self.toggle)
+        except (NotImplementedError, AttributeError, RuntimeError):
+            log.info("No SIGUSR1 on this platform; use the socket")
+        path = self.config['socket']
+        if os.path.exists(path):
+            os.unlink(path)
+        server = await asyncio.start_unix_server(self.handle, path=path)
+        log.info("Introspection socket listening on %s", path)
+        try:
+            await self.lag.watch()
+        finally:
+            server.close()
+            self.profiler.stop()
+
+    def toggle(self):
+        if self.profiler.start():
+            log.info("Profiler started")
+            return
+        self.profiler.stop()
+        path = os.path.join(self.config['dump_dir'], time.strftime(
+            'profile-%Y%m%d-%H%M%S.folded'))
+        with open(path, 'w') as f:
+            f.write(self.profiler.folded())
+        log.info("Profiler stopped after %s samples; wrote %s",
+                 self.profiler.samples, path)
+
+    def status(self):
+        return {
+            'tasks': task_states(),
+            'loop_lag': self.lag.summary(),
+            'slowest_stages': stages.slowest(self.config['slowest']),
+            'stages': stages.summary(),
+            'profiler': {'running': self.profiler.running,
+                         'samples': self.profiler.samples},
+        }
+
+    def command(self, request):
+        cmd = request.get('cmd')
+        if cmd == 'status':
+            return self.status()
+        if cmd == 'profile_start':
+            return {'started': self.profiler.start()}
+        if cmd == 'profile_stop':
+            stopped = self.profiler.stop()
+            return {'stopped': stopped, 'samples': self.profiler.samples,
+                    'folded': self.profiler.folded()}
+        return {'error': "unknown command {!r}".format(cmd)}
+
+    async def handle(self, reader, writer):
+        try:
+            request = json.loads(await reader.readline())
+            reply = self.command(request)
+        except Exception as e:
+            log.warning("Bad introspection request", exc_info=True)
+            reply = {'error': str(e)}
+        writer.write(json.dumps(reply).encode() + b'\n')
+        await writer.drain()
+        writer.close()
+
+
+def request(path, cmd):
+    """ Send one command to a running bot's introspection socket """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(path)
+        s.sendall(json.dumps({'cmd': cmd}).encode() + b'\n')
+        chunks = []
+        while True:
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return json.loads(b''.join(chunks))
@@ -0,0 +1,167 @@
+import os
+import sys
+import json
+import time
+import queue
+import logging
+import threading
+from decimal import Decimal
+
+import click
+
+log = logging.getLogger('journal')
+
+
+def encode(obj):
+    if isinstance(obj, Decimal):
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+    raise TypeError("Can't journal {!r}".format(obj))
+
+
+class NullJournal:
+    """ Stands in when no journal is configured """
+
+    def record(self, kind, **fields):
+        pass
+
+    def close(self):
+        pass
+
+
+class Journal:
+    """ Structured record of what the bot decided and did, written as NDJSON
+    by a background thread so the event loop only pays for a queue put.
+
+    Records are dicts with `t` (unix time), `kind` and the given fields. If
+    the writer falls behind and the queue fills up, records are dropped and
+    counted rather than blocking trading. Files rotate at `max_bytes` into
+    path.1 ... path.<backups>. """
+
+    def __init__(self, config):
+        self.path = config['path']
+        self.max_bytes = config['max_bytes']
+        self.backups = config['backups']
+        self.queue = queue.Queue(maxsize=config['queue_size'])
+        # counted by whichever thread hit the full queue, reset by the writer
+        self.dropped = 0
+        self.dropped_lock = threading.Lock()
+        self.closed = False
+        self.file = open(self.path, 'a')
+        self.size = self.file.tell()
+        self.thread = threading.Thread(
+            target=self.writer, name='journal', daemon=True)
+        self.thread.start()
+
+    def record(self, kind, **fields):
+        fields['t'] = time.time()
+        fields['kind'] = kind
+        try:
+            self.queue.put_nowait(fields)
+        except queue.Full:
+            with self.dropped_lock:
+                self.dropped += 1
+
+    def writer(self):
+        while True:
+            rec = self.queue.get()
+            if rec is None:
+                break
+            try:
+                self.write(rec)
+                # batch up whatever else is waiting before flushing
+                while True:
+                    try:
+                        rec = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if rec is None:
+                        self.file.flush()
+                        return
+                    self.write(rec)
+                with self.dropped_lock:
+                    dropped, self.dropped = self.dropped, 0
+                if dropped:
+                    self.write({'t': time.time(), 'kind': 'dropped',
+                                'count': dropped})
+                self.file.flush()
+            except Exception:
+                log.warning("Journal writer exploded", exc_info=True)
+
+    def write(self, rec):
+        line = json.dumps(rec, default=encode, separators=(',', ':')) + '\n'
+        if self.size + len(line) > self.max_bytes and self.size > 0:
+            self.rotate()
+        self.file.write(line)
+        self.size += len(line)
+
+    def rotate(self):
+        self.file.close()
+        for i in range(self.backups - 1, 0, -1):
+            src = "{}.{}".format(self.path, i)
+            if os.path.exists(src):
+                os.replace(src, "{}.{}".format(self.path, i + 1))
+        if self.backups > 0:
+            os.replace(self.path, self.path + '.1')
+        self.file = open(self.path, 'w')
+        self.size = 0
+
+    def close(self):
+        """ Flush everything queued so far and stop the writer. Safe to call
+        more than once, eg. from both `run` and atexit. """
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+
+
+def read_journal(path):
+    """ Yield records from `path` and its rotated files, oldest first """
+    paths = []
+    i = 1
+    while os.path.exists("{}.{}".format(path, i)):
+        paths.append("{}.{}".format(path, i))
+        i += 1
+    paths.reverse()
+    if os.path.exists(path):
+        paths.append(path)
+    for p in paths:
+        with open(p) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+@click.command()
+@click.argument('path', default="journal.ndjson")
+@click.option('--kind', '-k', multiple=True, help='only these record kinds')
+@click.option('--market', '-m', multiple=True, help='only records about these markets')
+@click.option('--since', '-s', default=None, type=float, help='only records from the last N seconds')
+@click.option('--raw', default=False, is_flag=True, help='print NDJSON instead of a summary line')
+def main(path, kind, market, since, raw):
+    """ Read a decision journal for post-mortems, eg.
+    python journal.py -k place -k cancel -m LTC_BTC --since 3600 """
+    start = time.time() - since if since is not None else None
+    for rec in read_journal(path):
+        if kind and rec['kind'] not in kind:
+            continue
+        if market and rec.get('market') not in market:
+            continue
+        if start is not None and rec['t'] < start:
+            continue
+        if raw:
+            sys.stdout.write(json.dumps(rec) + '\n')
+            continue
+        fields = ' '.join("{}={}".format(k, json.dumps(v))
+                          for k, v in rec.items() if k not in ('t', 'kind'))
+        print("{} {:<12} {}".format(
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(rec['t'])),
+            rec['kind'], fields))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,16 +3,63 @@ import yaml
 import sys
 import click
 import logging as log
-from qtrade_client.api import QtradeAPI
 
-from market_data_collector import MarketDataCollector
-from orderbook_manager import OrderbookManager
-from vol_bot import VolBot
+from plugins import PluginRegistry, LazyComponents
+
+
+def make_components(config, endpoint, key, config_path=None):
+    """ Components are only imported and built when a subcommand first uses
+    them, so eg. cancel_all never loads the scrapers. """
+    registry = PluginRegistry(config.get('plugins'))
+
+    def api(c):
+        from qtrade_client.api import QtradeAPI
+        from api_gateway import APIGateway
+        return APIGateway(QtradeAPI(endpoint, key=key), config['api_gateway'])
+
+    def mdc(c):
+        return registry.load('bots', 'mdc')(
+            config['market_data_collector'], api=c['api'], registry=registry)
+
+    def obm(c):
+        return registry.load('bots', 'obm')(
+            c['api'], config['orderbook_manager'], journal=c['journal'],
+            risk=c['risk'])
+
+    def journal(c):
+        import atexit
+        from journal import Journal
+        j = Journal(config['journal'])
+        # every subcommand that journals gets its queued records written out
+        atexit.register(j.close)
+        return j
+
+    def vol(c):
+        return registry.load('bots', 'vol')(config, c['api'], risk=c['risk'])
+
+    def risk(c):
+        from risk import RiskManager
+        return RiskManager(config.get('risk'))
+
+    def introspector(c):
+        from introspect import Introspector
+        return Introspector(config['introspect'])
+
+    def reloader(c):
+        from market_config import ConfigReloader
+        return ConfigReloader(
+            config_path, 'orderbook_manager', c['obm'].reload_config,
+            c['obm'].config.config_reload_period)
+
+    return LazyComponents({'api': api, 'mdc': mdc, 'obm': obm, 'vol': vol,
+                           'reloader': reloader, 'journal': journal,
+                           'risk': risk, 'introspector': introspector,
+                           'config': lambda c: config})
 
 
 @click.group()
 @click.option('--config', '-c', default="config.yml", type=click.File())
-@click.option('--endpoint', '-e', default="https://api.qtrade.io", help='qtrade backend endpoint')
+@click.option('--endpoint', '-e', default="https://api.qtrade.io", help='qtrade backend endpoint, eg. http://127.0.0.1:8420 for exchange_sim.py')
 @click.option('--keyfile', '-f', default="lpbot_hmac.txt", help='a file with the hmac key', type=click.File('r'))
 @click.option('--verbose', '-v', default=False, is_flag=True)
 @click.pass_context
@@ -28,13 +75,10 @@ def cli(ctx, config, endpoint, keyfile, verbose):
     handler.setFormatter(formatter)
     root.addHandler(handler)
 
-    api = QtradeAPI(endpoint, key=keyfile.read().strip())
-    config = yaml.load(config)
-
-    ctx.obj['mdc'] = MarketDataCollector(config['market_data_collector'])
-    ctx.obj['obm'] = OrderbookManager(
-        api, config['orderbook_manager'])
-    #ctx.obj['vol'] = VolBot(config, api)
+    config_path = config.name
+    config = yaml.safe_load(config)
+    ctx.obj = make_components(config, endpoint, keyfile.read().strip(),
+                              config_path=config_path)
 
 
 @cli.command()
@@ -42,9 +86,12 @@ def cli(ctx, config, endpoint, keyfile, verbose):
 def run(ctx):
     loop = asyncio.get_event_loop()
     try:
-        loop.create_task(ctx.obj['obm'].monitor())
-        loop.create_task(ctx.obj['mdc'].daemon())
-        #loop.create_task(ctx.obj['vol'].run())
+        loop.create_task(ctx.obj['obm'].monitor(), name='obm')
+        loop.create_task(ctx.obj['mdc'].daemon(), name='mdc')
+        loop.create_task(ctx.obj['api'].reporter(), name='api_reporter')
+        loop.create_task(ctx.obj['reloader'].watch(), name='reloader')
+        loop.create_task(ctx.obj['introspector'].serve(), name='introspector')
+        #loop.create_task(ctx.obj['vol'].run(), name='vol')
         loop.run_forever()
     except KeyboardInterrupt:
         pass
@@ -66,6 +113,7 @@ def mdc(ctx):
 def obm(ctx):
     loop = asyncio.get_event_loop()
     loop.create_task(ctx.obj['obm'].monitor())
+    loop.create_task(ctx.obj['reloader'].watch())
     loop.run_forever()
 
 
@@ -77,10 +125,37 @@ def vol(ctx):
     loop.run_forever()
 
 
+@cli.command()
+@click.argument('action', type=click.Choice(['status', 'profile']), default='status')
+@click.option('--seconds', '-s', default=10.0, help='how long to profile for')
+@click.option('--out', '-o', default="profile.folded", type=click.Path(),
+              help='where to write collapsed stacks, for flamegraph.pl or speedscope')
+@click.option('--socket', 'path', default=None, help='defaults to introspect.socket in config.yml')
+@click.pass_context
+def introspect(ctx, action, seconds, out, path):
+    """ Look inside a running `run`: task states, event loop lag and the
+    slowest recent stages, or a sampling profile of the threads running bot code """
+    import json
+    import time
+    from introspect import request
+    path = path or ctx.obj['config']['introspect']['socket']
+    if action == 'status':
+        print(json.dumps(request(path, 'status'), indent=2))
+        return
+    if not request(path, 'profile_start')['started']:
+        print("A profile is already running")
+        return
+    time.sleep(seconds)
+    res = request(path, 'profile_stop')
+    with open(out, 'w') as f:
+        f.write(res['folded'])
+    print("Wrote {} samples to {}".format(res['samples'], out))
+
+
 @cli.command()
 @click.pass_context
 def balances_test(ctx):
-    print(ctx.obj['obm'].api.balances_merged())
+    print(ctx.obj['api'].balances_merged())
 
 
 @cli.command()
@@ -115,7 +190,7 @@ def update_orders_test(ctx):
 @cli.command()
 @click.pass_context
 def cancel_all(ctx):
-    ctx.obj['obm'].api.cancel_all_orders()
+    ctx.obj['api'].cancel_all_orders()
 
 
 @cli.command()
@@ -0,0 +1,219 @@
+import os
+import asyncio
+import logging
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+from types import MappingProxyType
+
+import yaml
+
+log = logging.getLogger('config')
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def to_decimal(value, what, minimum=None, maximum=None):
+    """ Convert a YAML number to Decimal through its string form, so 0.1 is
+    exactly 0.1 rather than the nearest binary float. """
+    if isinstance(value, bool):
+        raise ConfigError("{} must be a number, got {!r}".format(what, value))
+    try:
+        d = Decimal(str(value))
+    except (InvalidOperation, TypeError, ValueError):
+        raise ConfigError("{} must be a number, got {!r}".format(what, value))
+    if not d.is_finite():
+        raise ConfigError("{} must be finite, got {!r}".format(what, value))
+    if minimum is not None and d < minimum:
+        raise ConfigError("{} must be at least {}, got {}".format(what, minimum, d))
+    if maximum is not None and d > maximum:
+        raise ConfigError("{} must be at most {}, got {}".format(what, maximum, d))
+    return d
+
+
+def compile_ladder(raw, what, max_slip=None):
+    """ Returns ((slip, ratio), ...) sorted by slip, nearest the book first """
+    if not isinstance(raw, dict) or not raw:
+        raise ConfigError("{} must be a map of slip: ratio".format(what))
+    ladder = tuple(sorted(
+        (to_decimal(slip, what + " slip", minimum=0, maximum=max_slip),
+         to_decimal(ratio, what + " ratio", minimum=0))
+        for slip, ratio in raw.items()))
+    if sum(r for _, r in ladder) > 1:
+        raise ConfigError("{} ratios add up to more than 1".format(what))
+    return ladder
+
+
+class MarketConfig(namedtuple('MarketConfig', [
+        'market_string', 'market_currency', 'base_currency', 'allocations',
+        'buy_ladder', 'sell_ladder'])):
+    """ One market's settings with Decimal allocations and ladders, compiled
+    from its config.yml entry merged over `default`. """
+    __slots__ = ()
+
+    @classmethod
+    def compile(cls, market_string, raw, default=None):
+        merged = dict(default or {})
+        merged.update(raw or {})
+        try:
+            market_currency, base_currency = market_string.split('_')
+        except ValueError:
+            raise ConfigError("Market {!r} isn't in MARKET_BASE format".format(
+                market_string))
+
+        allocations = {}
+        for coin in (market_currency, base_currency):
+            if coin not in merged:
+                raise ConfigError("{} has no {} allocation".format(
+                    market_string, coin))
+            allocations[coin] = to_decimal(
+                merged[coin], "{} {} allocation".format(market_string, coin),
+                minimum=0, maximum=1)
+
+        intervals = merged.get('intervals') or {}
+        for side in ('buy_limit', 'sell_limit'):
+            if side not in intervals:
+                raise ConfigError("{} has no {} intervals".format(
+                    market_string, side))
+        return cls(
+            market_string, market_currency, base_currency,
+            MappingProxyType(allocations),
+            # a buy slip of 1 or more would price at or below zero
+            compile_ladder(intervals['buy_limit'],
+                           market_string + " buy_limit", max_slip=Decimal('0.99999999')),
+            compile_ladder(intervals['sell_limit'], market_string + " sell_limit"))
+
+
+class VolatilityScaling(namedtuple('VolatilityScaling', [
+        'target_hourly_vol', 'min_scale', 'max_scale', 'min_samples'])):
+    __slots__ = ()
+
+    @classmethod
+    def compile(cls, raw):
+        if raw is None:
+            return None
+        min_scale = to_decimal(raw['min_scale'], "min_scale", minimum=0)
+        # a scale of 0 would price every level at the bid or ask
+        if min_scale == 0:
+            raise ConfigError("min_scale must be more than 0")
+        return cls(
+            target_hourly_vol=float(to_decimal(
+                raw['target_hourly_vol'], "target_hourly_vol",
+                minimum=Decimal('0.00000001'))),
+            min_scale=min_scale,
+            max_scale=to_decimal(raw['max_scale'], "max_scale", minimum=min_scale),
+            min_samples=int(to_decimal(raw['min_samples'], "min_samples", minimum=1)))
+
+
+class OrderbookConfig(namedtuple('OrderbookConfig', [
+        'markets', 'currency_reserves', 'monitor_period', 'reserve_thresh_usd',
+        'price_tolerance', 'amount_tolerance', 'dry_run_mode', 'cost_basis_btc',
+        'config_reload_period', 'volatility_scaling', 'state_path',
+        'max_cycle_failures', 'currency_steps'])):
+    """ Validated, read only form of the orderbook_manager config section """
+    __slots__ = ()
+
+    @classmethod
+    def compile(cls, raw):
+        try:
+            raw_markets = dict(raw['markets'])
+            default = raw_markets.pop('default', None)
+            markets = {ms: MarketConfig.compile(ms, mkt, default=default)
+                       for ms, mkt in raw_markets.items()}
+            reserves = {coin: to_decimal(r, coin + " reserve", minimum=0)
+                        for coin, r in raw['currency_reserves'].items()}
+
+            totals = {}
+            for mc in markets.values():
+                for coin, alloc in mc.allocations.items():
+                    if coin not in reserves:
+                        raise ConfigError("{} is traded on {} but has no "
+                                          "currency reserve".format(coin, mc.market_string))
+                    totals[coin] = totals.get(coin, 0) + alloc
+            for coin, total in totals.items():
+                if total > 1:
+                    raise ConfigError("{} allocations add up to {}, more "
+                                      "than 1".format(coin, total))
+
+            # smallest amount of each currency, for currencies that don't
+            # have 8 decimal places
+            steps = {coin: Decimal(1).scaleb(-int(to_decimal(
+                         places, coin + " precision", minimum=0, maximum=18)))
+                     for coin, places in (raw.get('currency_precision') or {}).items()}
+
+            if not isinstance(raw['dry_run_mode'], bool):
+                raise ConfigError("dry_run_mode must be true or false")
+
+            return cls(
+                markets=MappingProxyType(markets),
+                currency_reserves=MappingProxyType(reserves),
+                monitor_period=float(to_decimal(
+                    raw['monitor_period'], "monitor_period", minimum=0)),
+                reserve_thresh_usd=to_decimal(
+                    raw['reserve_thresh_usd'], "reserve_thresh_usd", minimum=0),
+                price_tolerance=to_decimal(
+                    raw['price_tolerance'], "price_tolerance", minimum=0),
+                amount_tolerance=to_decimal(
+                    raw['amount_tolerance'], "amount_tolerance", minimum=0),
+                dry_run_mode=raw['dry_run_mode'],
+                cost_basis_btc=to_decimal(raw['cost_basis_btc'], "cost_basis_btc"),
+                config_reload_period=float(to_decimal(
+                    raw['config_reload_period'], "config_reload_period", minimum=0)),
+                volatility_scaling=VolatilityScaling.compile(
+                    raw.get('volatility_scaling')),
+                # without a state file every start is a cold start
+                state_path=raw.get('state_path'),
+                max_cycle_failures=int(to_decimal(
+                    raw.get('max_cycle_failures', 1), "max_cycle_failures",
+                    minimum=1)),
+                currency_steps=MappingProxyType(steps),
+            )
+        except KeyError as e:
+            raise ConfigError("Missing orderbook_manager setting {}".format(e))
+
+
+class ConfigReloader:
+    """ Polls config.yml and hands a changed orderbook_manager section to
+    `on_change`. If that raises (eg. the new config doesn't validate) the
+    running config is kept. """
+
+    def __init__(self, path, section, on_change, period):
+        self.path = path
+        self.section = section
+        self.on_change = on_change
+        self.period = period
+        self.mtime = self.stat()
+        self.current = self.read()
+
+    def stat(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def read(self):
+        with open(self.path) as f:
+            return yaml.safe_load(f)[self.section]
+
+    def check(self):
+        mtime = self.stat()
+        if mtime is None or mtime == self.mtime:
+            return False
+        self.mtime = mtime
+        try:
+            raw = self.read()
+            if raw == self.current:
+                return False
+            self.on_change(raw)
+        except Exception as e:
+            log.warning("Not reloading %s: %s", self.path, e)
+            return False
+        self.current = raw
+        log.info("Reloaded %s section of %s", self.section, self.path)
+        return True
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(self.period)
+            self.check()
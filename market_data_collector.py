@@ -1,52 +1,118 @@
+import time
 import asyncio
 import logging
 
+from analytics import AnalyticsPipeline
 from data_classes import ExchangeDatastore
-from market_scrapers import QTradeScraper, BittrexScraper, CCXTScraper
-
-scraper_classes = {
-    "qtrade": QTradeScraper,
-    "bittrex": BittrexScraper,
-    "ccxt": CCXTScraper
-}
+from introspect import stages
+from plugins import PluginRegistry
+from poll_scheduler import PollScheduler
 
 log = logging.getLogger('mdc')
 
 
 class MarketDataCollector:
 
-    def __init__(self, config):
+    def __init__(self, config, api=None, registry=None):
         # load config from yaml file
         self.config = config
-        # load scrapers
+        registry = registry or PluginRegistry()
+        # load scrapers; qTrade scrapers share the bot's rate limited api
         self.scrapers = []
         for name, cfg in self.config['scrapers'].items():
-            self.scrapers.append(
-                scraper_classes[name](exchange_name=name, **cfg))
+            self.scrapers.append(registry.load('scrapers', name)(
+                exchange_name=name, api=api, **cfg))
+        self.scheduler = PollScheduler(
+            self.scrapers, self.config['scheduler'], self.config['update_period'])
+        self.analytics = AnalyticsPipeline(self.config['analytics'])
+        # in-flight poll tasks; the loop only holds weak references to them
+        self.polls = set()
 
     def update_tickers(self):
         log.debug("Updating tickers...")
         for s in self.scrapers:
-            ExchangeDatastore.tickers[s.exchange_name] = s.scrape_ticker()
+            tickers = s.scrape_ticker()
+            if tickers is not None:
+                ExchangeDatastore.tickers[s.exchange_name] = tickers
+                for market, ticker in tickers.items():
+                    self.analytics.on_ticker(s.exchange_name, market, ticker)
 
     def update_midpoints(self):  # be sure to update tickers first
-        log.debug("Updating midpoints...")
-        for exchange_name, markets in ExchangeDatastore.tickers.items():
-            for market, ticker in markets.items():
-                bid = ticker["bid"]
-                last = ticker["last"]
-                ExchangeDatastore.midpoints.setdefault(exchange_name, {})
-                ExchangeDatastore.midpoints[exchange_name][
-                    market] = (bid + last) / 2
+        # only markets whose tickers changed since the last call
+        log.debug("Updating %s midpoints...", len(self.analytics.dirty))
+        self.analytics.process()
+
+    def scrape(self, target):
+        try:
+            with stages.time('mdc.scrape', "{} {}".format(target.venue, target.market)):
+                return target.scraper.scrape_market(target.market)
+        except Exception:
+            log.warning("Failed to scrape %s from %s", target.market,
+                        target.venue, exc_info=True)
+            return None
+
+    async def poll(self, target):
+        """ Scrape one (venue, market) and reschedule it. The scrape runs on
+        a worker thread so it competes for the qTrade budget with the other
+        bots' calls instead of blocking the event loop; everything that
+        touches the datastore stays on the loop. """
+        loop = asyncio.get_event_loop()
+        ticker = await loop.run_in_executor(None, self.scrape, target)
+        mid = None
+        if ticker is not None:
+            ExchangeDatastore.tickers.setdefault(
+                target.venue, {})[target.qmarket] = ticker
+            self.analytics.on_ticker(target.venue, target.qmarket, ticker)
+            with stages.time('mdc.analytics'):
+                self.analytics.process()
+            mid = ExchangeDatastore.midpoints[target.venue][target.qmarket]
+        self.scheduler.record(target, mid)
+        ExchangeDatastore.poll_intervals.setdefault(
+            target.venue, {})[target.qmarket] = target.interval
+
+    async def poll_task(self, target, slots):
+        try:
+            await self.poll(target)
+        except Exception:
+            log.warning("Polling %s on %s exploded", target.market,
+                        target.venue, exc_info=True)
+        finally:
+            self.scheduler.release(target)
+            slots.release()
+            # it's back on the heap, maybe due sooner than what we're waiting on
+            self.rescheduled.set()
 
     async def daemon(self):
-        log.info("Starting market data collector; interval period %s sec",
-                 self.config['update_period'])
+        log.info("Starting market data collector; polling every %s-%s sec, "
+                 "up to %s at a time",
+                 self.scheduler.config['min_interval'],
+                 self.scheduler.config['max_interval'],
+                 self.config['max_concurrent_polls'])
+        if not self.scheduler.targets:
+            log.warning("No markets to poll")
+        loop = asyncio.get_event_loop()
+        # due polls run as their own tasks, so one slow venue doesn't hold
+        # up every other market; the semaphore bounds how many are in flight
+        slots = asyncio.Semaphore(self.config['max_concurrent_polls'])
+        self.rescheduled = asyncio.Event()
+        last_report = time.monotonic()
         while True:
             try:
-                log.info("Pulling market data...")
-                self.update_tickers()
-                self.update_midpoints()
-                await asyncio.sleep(self.config["update_period"])
+                self.rescheduled.clear()
+                delay = self.scheduler.next_due()
+                if delay is None or delay > 0:
+                    try:
+                        await asyncio.wait_for(self.rescheduled.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await slots.acquire()
+                task = loop.create_task(self.poll_task(self.scheduler.pop(), slots))
+                self.polls.add(task)
+                task.add_done_callback(self.polls.discard)
+                if time.monotonic() - last_report >= self.config['update_period']:
+                    self.scheduler.report()
+                    last_report = time.monotonic()
             except Exception:
                 log.warning("Market scraper loop exploded", exc_info=True)
+                await asyncio.sleep(1)
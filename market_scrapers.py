@@ -9,6 +9,7 @@ from decimal import Decimal
 from pprint import pprint
 
 from qtrade_client.api import QtradeAPI
+from records import Ticker
 
 COIN = Decimal('.00000001')
 
@@ -18,32 +19,45 @@ class APIScraper:
     def __init__(self, **kwargs):
         self.__dict__.update(**kwargs)
 
-    def scrape_ticker(self):  # dummy function, meant to be overridden
+    def scrape_ticker(self):
+        tickers = {}
+        for market, qmarket in self.markets.items():
+            ticker = self.scrape_market(market)
+            if ticker is not None:
+                tickers[qmarket] = ticker
+        return tickers
+
+    def scrape_market(self, market):  # dummy function, meant to be overridden
         pass
 
+    def headroom(self):
+        """ Fraction of this venue's request budget that's left; 1 when we
+        don't track it """
+        return 1
+
 
 class QTradeScraper(APIScraper):
 
-    def __init__(self, **kwargs):
-        self.api = QtradeAPI("https://api.qtrade.io",
-                             key=open("lpbot_hmac.txt", "r").read().strip())
+    def __init__(self, api=None, **kwargs):
+        if api is None:
+            api = QtradeAPI("https://api.qtrade.io",
+                            key=open("lpbot_hmac.txt", "r").read().strip())
+        self.api = api
         super().__init__(**kwargs)
 
-    def scrape_ticker(self):
-        tickers = {}
-        for market, qmarket in self.markets.items():
-            res = self.api.get("/v1/ticker/{}".format(market))
+    def scrape_market(self, market):
+        res = self.api.get("/v1/ticker/{}".format(market))
 
-            log.debug("Ticker %s from %s was acquired successfully",
-                      market, self.exchange_name)
-            bid = Decimal(res["bid"]).quantize(COIN)
-            log.debug("Bid price is %s", bid)
-            last = Decimal(res["last"]).quantize(COIN)
-            log.debug("Last price is %s", last)
-            ask = Decimal(res["ask"]).quantize(COIN)
-            log.debug("Ask price is %s", ask)
-            tickers[qmarket] = {"bid": bid, "last": last, "ask": ask}
-        return tickers
+        log.debug("Ticker %s from %s was acquired successfully",
+                  market, self.exchange_name)
+        ticker = Ticker.parse(res)
+        log.debug("Bid %s, last %s, ask %s", ticker.bid, ticker.last, ticker.ask)
+        return ticker
+
+    def headroom(self):
+        # only the shared APIGateway tracks the rate limit
+        headroom = getattr(self.api, 'headroom', None)
+        return 1 if headroom is None else headroom()
 
 
 class BittrexScraper(APIScraper):
@@ -51,27 +65,24 @@ class BittrexScraper(APIScraper):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
-    def scrape_ticker(self):
-        tickers = {}
-        for market, qmarket in self.markets.items():
-            res = json.loads(requests.get(
-                'https://api.bittrex.com/api/v1.1/public/getticker?market=' + market).content)
+    def scrape_market(self, market):
+        res = json.loads(requests.get(
+            'https://api.bittrex.com/api/v1.1/public/getticker?market=' + market).content)
 
-            if not res['success']:
-                log.warning("Could not acquire ticker %s from %s",
-                            market, self.exchange_name)
-                return
+        if not res['success']:
+            log.warning("Could not acquire ticker %s from %s",
+                        market, self.exchange_name)
+            return
 
-            log.debug("Ticker %s from %s was acquired successfully",
-                      market, self.exchange_name)
-            bid = Decimal(res["result"]["Bid"]).quantize(COIN)
-            log.debug("Bid price is %s", bid)
-            last = Decimal(res["result"]["Last"]).quantize(COIN)
-            log.debug("Last price is %s", last)
-            ask = Decimal(res["result"]["Ask"]).quantize(COIN)
-            log.debug("Ask price is %s", ask)
-            tickers[qmarket] = {"bid": bid, "last": last, "ask": ask}
-        return tickers
+        log.debug("Ticker %s from %s was acquired successfully",
+                  market, self.exchange_name)
+        bid = Decimal(res["result"]["Bid"]).quantize(COIN)
+        log.debug("Bid price is %s", bid)
+        last = Decimal(res["result"]["Last"]).quantize(COIN)
+        log.debug("Last price is %s", last)
+        ask = Decimal(res["result"]["Ask"]).quantize(COIN)
+        log.debug("Ask price is %s", ask)
+        return Ticker.from_prices(bid, last, ask)
 
 
 class CCXTScraper(APIScraper):
@@ -79,31 +90,28 @@ class CCXTScraper(APIScraper):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
-    def scrape_ticker(self):
-        tickers = {}
-        for market, qmarket in self.markets.items():
-            bid_total = Decimal('0')
-            last_total = Decimal('0')
-            ask_total = Decimal('0')
-            for ex_id in self.exchanges:
-                res = ex_class = getattr(ccxt, ex_id)
-                ex = ex_class({
-                    'apiKey': '',
-                    'secret': '',
-                    'timeout': 30000,
-                    'enableRateLimit': True,
-                })
-                res = ex.fetchTicker(market)
-                log.debug("Ticker %s from %s was acquired successfully",
-                          market, ex_id)
-                bid_total += Decimal(res['bid'])
-                last_total += Decimal(res['last'])
-                ask_total += Decimal(res['ask'])
-            bid_total = (bid_total/len(self.exchanges)).quantize(COIN)
-            last_total = (last_total/len(self.exchanges)).quantize(COIN)
-            ask_total = (ask_total/len(self.exchanges)).quantize(COIN)
-            tickers[qmarket] = {"bid": bid_total, "last": last_total, "ask": ask_total}
-        return tickers
+    def scrape_market(self, market):
+        bid_total = Decimal('0')
+        last_total = Decimal('0')
+        ask_total = Decimal('0')
+        for ex_id in self.exchanges:
+            res = ex_class = getattr(ccxt, ex_id)
+            ex = ex_class({
+                'apiKey': '',
+                'secret': '',
+                'timeout': 30000,
+                'enableRateLimit': True,
+            })
+            res = ex.fetchTicker(market)
+            log.debug("Ticker %s from %s was acquired successfully",
+                      market, ex_id)
+            bid_total += Decimal(res['bid'])
+            last_total += Decimal(res['last'])
+            ask_total += Decimal(res['ask'])
+        bid_total = (bid_total/len(self.exchanges)).quantize(COIN)
+        last_total = (last_total/len(self.exchanges)).quantize(COIN)
+        ask_total = (ask_total/len(self.exchanges)).quantize(COIN)
+        return Ticker.from_prices(bid_total, last_total, ask_total)
 
 
 if __name__ == "__main__":
@@ -1,39 +1,111 @@
 from typing import Union
 
+import os
+import json
+import time
 import asyncio
 import logging
 import heapq
 from decimal import Decimal
 
 from data_classes import ExchangeDatastore
+from introspect import stages
+from journal import NullJournal
+from market_config import OrderbookConfig
 from qtrade_client.api import QtradeAPI, APIException
-
-from pprint import pprint, pformat
+from records import Order, Trade, from_sats
+from risk import RiskManager, RiskRejected
 
 COIN = Decimal('.00000001')
 PERC = Decimal('.01')
+SCALE = Decimal('.01')
 
-log = logging.getLogger('obm')
-
+# Venues whose bid/ask we quote around, most trusted first
+QUOTE_SOURCES = ('bittrex', 'ccxt', 'qtrade')
+SIDES = (('buy_limit', 'buy'), ('sell_limit', 'sell'))
 
-class MarketConfig(dict):
-
-    def __init__(self, market_string, config, default={}):
-        self.market_string = market_string
-        self.update(default)
-        self.update(config)
+log = logging.getLogger('obm')
 
 
 class OrderbookManager:
 
-    def __init__(self, api, config):
+    def __init__(self, api, config, journal=None, risk=None):
+        if not isinstance(config, OrderbookConfig):
+            config = OrderbookConfig.compile(config)
         self.config = config
         self.api = api
-        self.prev_alloc_profile = None
-        self.market_configs = {
-            ms: MarketConfig(ms, mkt, default=config['markets'].get('default'))
-            for ms, mkt in config['markets'].items()
-            if ms != 'default'}
+        self.journal = journal or NullJournal()
+        # without configured limits this only keeps the exposure ledger
+        self.risk = risk or RiskManager({})
+        # profiles we last placed, by market
+        self.prev_alloc_profile = {}
+        # (inputs, profile) of the last profile generated for each market
+        self.profile_cache = {}
+        # (profile, prev_profile, dirty) of the last drift check per market
+        self.drift_checks = {}
+        self._coin_markets = None
+        # qTrade market id -> market string; ids never change
+        self.market_strings = {}
+        # markets dropped from the config whose orders still need cancelling
+        self.retired_markets = set()
+        # markets whose config changed since we last placed them
+        self.reconfigured_markets = set()
+        # dirty markets whose requote the risk limits wouldn't allow
+        self.held_markets = set()
+        self.most_recent_trade_id = None
+        # merged balances from the last compute_allocations
+        self.balances = {}
+        self.rates = ExchangeDatastore.rates
+        # reloaded config waiting for the next cycle to start
+        self.pending_config = None
+
+    @property
+    def market_configs(self):
+        return self.config.markets
+
+    def reload_config(self, raw):
+        """ Compile a new orderbook_manager config, to be swapped in without
+        touching resting orders when the next cycle starts. Markets whose
+        settings changed are requoted on that cycle; raises ConfigError and
+        keeps the running config if the new one doesn't validate. """
+        # cycles run on a worker thread, so never swap the config mid-cycle
+        self.pending_config = OrderbookConfig.compile(raw)
+
+    def apply_config(self):
+        config, self.pending_config = self.pending_config, None
+        if config is None:
+            return
+        old = self.config
+        retired = old.markets.keys() - config.markets.keys()
+        self.config = config
+        self.profile_cache.clear()
+        self.drift_checks.clear()
+        self._coin_markets = None
+        self.retired_markets.update(retired)
+        self.reconfigured_markets -= retired
+        if retired:
+            log.info("Markets %s were removed from the config",
+                     ', '.join(sorted(retired)))
+        changed = self.changed_markets(old, config)
+        self.reconfigured_markets.update(changed)
+        if changed:
+            log.info("Settings for %s changed, requoting them",
+                     ', '.join(sorted(changed)))
+
+    def changed_markets(self, old, new):
+        """ Markets of `new` that would be quoted differently than under
+        `old`. The drift checks can't be relied on for this: they only
+        catch prices and amounts that went up, and ignore ladder levels
+        that were added or removed. """
+        if old.volatility_scaling != new.volatility_scaling:
+            return set(new.markets)
+        coins = {coin for coin in set(old.currency_reserves) | set(new.currency_reserves)
+                 if old.currency_reserves.get(coin) != new.currency_reserves.get(coin)}
+        coins.update(coin for coin in set(old.currency_steps) | set(new.currency_steps)
+                     if old.currency_steps.get(coin) != new.currency_steps.get(coin))
+        return {market for market, mc in new.markets.items()
+                if old.markets.get(market, mc) != mc
+                or mc.market_currency in coins or mc.base_currency in coins}
 
     def compute_allocations(self):
         """ Given our allocation % targets and our current balances, figure out
@@ -43,30 +115,23 @@ class OrderbookManager:
             "DOGE_BTC": [1200, 0.0012],
         }
         """
-        balances = {c: Decimal(b)
-                    for c, b in self.api.balances_merged().items()}
-        balances.update({c: 0 for c in self.config[
-                        'currency_reserves'] if c not in balances.keys()})
-        reserve_config = self.config['currency_reserves']
+        self.balances = self.api.balances_merged()
+        balances = {c: Decimal(b) for c, b in self.balances.items()}
+        reserve_config = self.config.currency_reserves
+        balances.update({c: 0 for c in reserve_config
+                         if c not in balances.keys()})
         allocs = {}
-        for market_string, market_alloc in self.market_configs.items():
-            market = self.api.markets[market_string]
+        for market_string, mc in self.config.markets.items():
 
             def allocate_coin(coin):
                 """ Factor in allocation precentage and reserve amount to
                 determine how much (base|market)-currency we're going to
                 allocate to orders on this particular market. """
-                reserve = Decimal(reserve_config[coin])
-                alloc_perc = Decimal(market_alloc[coin])
-
-                post_reserve = balances[coin] - reserve
-                return max(post_reserve * alloc_perc, 0)
-
-            market_amount = allocate_coin(market['market_currency']['code'])
-            base_amount = allocate_coin(market['base_currency']['code'])
+                post_reserve = balances[coin] - reserve_config[coin]
+                return max(post_reserve * mc.allocations[coin], 0)
 
-            # TODO: At some point COIN will need to be based off base currency
-            # precision. Not needed until we have ETH base markets really
+            market_amount = allocate_coin(mc.market_currency)
+            base_amount = allocate_coin(mc.base_currency)
             allocs[market_string] = (market_amount, base_amount)
         return allocs
 
@@ -84,19 +149,21 @@ class OrderbookManager:
         """
         buy_allocs = []
         sell_allocs = []
-        mc = self.market_configs[market_string]
-        for slip, ratio in mc['intervals']['sell_limit'].items():
-            ratio = Decimal(ratio)
-            amount = (market_alloc * ratio).quantize(COIN)
+        mc = self.config.markets[market_string]
+        steps = self.config.currency_steps
+        market_step = steps.get(mc.market_currency, COIN)
+        base_step = steps.get(mc.base_currency, COIN)
+        for slip, ratio in mc.sell_ladder:
+            amount = (market_alloc * ratio).quantize(market_step)
             sell_allocs.append((slip, amount))
-        for slip, ratio in mc['intervals']['buy_limit'].items():
-            ratio = Decimal(ratio)
-            value = (base_alloc * ratio).quantize(COIN)
+        for slip, ratio in mc.buy_ladder:
+            value = (base_alloc * ratio).quantize(base_step)
             buy_allocs.append((slip, value))
         return {'buy_limit': buy_allocs, 'sell_limit': sell_allocs}
 
-    def price_orders(self, orders, bid, ask):
-        """
+    def price_orders(self, orders, bid, ask, scale=1):
+        """ `scale` multiplies every slip, widening (> 1) or narrowing (< 1)
+        the ladder around the bid and ask.
         return {
             "buy_limit": [
                 (0.00000033, 0.00001256),
@@ -109,40 +176,124 @@ class OrderbookManager:
         priced_buy_orders = []
         bid = Decimal(bid)
         ask = Decimal(ask)
+        # slips come from the compiled config ladders, already Decimal
         for slip, amount in orders['sell_limit']:
-            slip = Decimal(slip)
-            price = (ask + (ask * slip)).quantize(COIN)
+            price = (ask + (ask * slip * scale)).quantize(COIN)
             priced_sell_orders.append((price, amount))
         for slip, value in orders['buy_limit']:
-            slip = Decimal(slip)
-            price = (bid - (bid * slip)).quantize(COIN)
+            # a widened ladder mustn't push buys to or below zero
+            price = max((bid - (bid * slip * scale)).quantize(COIN), COIN)
             priced_buy_orders.append((price, value))
         return {'buy_limit': priced_buy_orders, 'sell_limit': priced_sell_orders}
 
     def rebalance_orders(self, allocation_profile, orders, force=False):
-        if self.check_for_rebalance(allocation_profile) is False and force is False:
+        if force is True:
+            dirty = set(allocation_profile)
+        else:
+            dirty = self.check_for_rebalance(allocation_profile, orders)
+        self.held_markets &= dirty
+        if not dirty and not self.retired_markets:
             return
 
-        if self.config['dry_run_mode']:
+        self.journal.record('rebalance', dirty=sorted(dirty), forced=force,
+                            retired=sorted(self.retired_markets),
+                            markets=len(allocation_profile),
+                            dry_run=self.config.dry_run_mode)
+        if self.config.dry_run_mode:
             log.warning(
                 "You are in dry run mode! Orders will not be cancelled or placed!")
-            #pprint(allocation_profile)
             return
 
-        self.api.cancel_all_orders()
+        retired = set(self.retired_markets)
+        for market_string in retired:
+            log.info("Cancelling orders on retired market %s", market_string)
+            self.cancel_orders(orders.get(market_string, {}), market_string)
+            self.prev_alloc_profile.pop(market_string, None)
+        self.retired_markets.clear()
+        if not dirty:
+            return
 
-        for market_string, profile in allocation_profile.items():
-            for price, value in profile['buy_limit']:
-                self.place_order('buy_limit', market_string, price, value)
-            for price, amount in profile['sell_limit']:
-                self.place_order('sell_limit', market_string, price, amount)
-        self.prev_alloc_profile = allocation_profile
+        # check every ladder before cancelling anything, so a requote the
+        # limits won't allow leaves the market's resting orders alone
+        # instead of pulling them and having the new ones rejected
+        held = self.risk.check_ladders({
+            market_string: [(order_type, price, quantity)
+                            for order_type, _ in SIDES
+                            for price, quantity in allocation_profile[market_string][order_type]
+                            if quantity > 0]
+            for market_string in sorted(dirty)})
+        for market_string, reason in held.items():
+            if market_string in self.held_markets:
+                log.debug("Still not requoting %s: %s", market_string, reason)
+                continue
+            log.warning("Not requoting %s, its new orders wouldn't pass the "
+                        "risk checks: %s", market_string, reason)
+            self.journal.record('risk_reject', market=market_string,
+                                reason=reason, requote=True)
+        self.held_markets = set(held)
+        dirty = dirty - held.keys()
+        if not dirty:
+            return
+
+        log.info("Requoting %s of %s markets", len(dirty),
+                 len(allocation_profile))
+        # cancel_all_orders would also take down markets left out of this
+        # profile (eg. no ticker yet) that we still think are resting, so
+        # only use it when everything is being requoted
+        covered = dirty | retired
+        if covered.issuperset(self.prev_alloc_profile) and covered.issuperset(orders):
+            self.journal.record('cancel_all')
+            self.api.cancel_all_orders()
+            self.risk.clear()
+        else:
+            for market_string in dirty:
+                self.cancel_orders(orders.get(market_string, {}), market_string)
+
+        for market_string in dirty:
+            profile = allocation_profile[market_string]
+            # what actually went out; levels that didn't are left at zero,
+            # so the drift check requotes them next cycle
+            placed = {order_type: [
+                (price, quantity) if self.place_order(
+                    order_type, market_string, price, quantity)
+                else (price, Decimal(0))
+                for price, quantity in profile[order_type]]
+                for order_type, _ in SIDES}
+            if placed != profile:
+                log.warning("Not every order on %s was placed, requoting it "
+                            "next cycle", market_string)
+                profile = placed
+            self.prev_alloc_profile[market_string] = profile
+            self.reconfigured_markets.discard(market_string)
+
+    def cancel_orders(self, market_orders, market_string):
+        """ Cancel one market's orders, as sorted by get_orders """
+        for o in market_orders.get('buy', []) + market_orders.get('sell', []):
+            self.journal.record('cancel', market=market_string, id=o.id)
+            try:
+                self.api.post('/v1/user/cancel_order', json={'id': o.id})
+            except APIException as e:
+                # most likely filled or cancelled since we listed it
+                if e.code == 400:
+                    log.warning("Caught API error cancelling order %s!", o.id)
+                else:
+                    raise e
+        self.risk.clear_market(market_string)
 
     def place_order(self, order_type, market_string, price, quantity):
+        """ Returns False if the order was rejected, by the risk checks or
+        the exchange, and True otherwise; an empty level counts as placed """
         if quantity <= 0:
-            return
-        log.debug("Placing %s on %s market for %s at %s",
-                 order_type, market_string, quantity, price)
+            return True
+        try:
+            self.risk.check(order_type, market_string, price, quantity)
+        except RiskRejected as e:
+            log.warning("Not placing %s %s at %s on %s: %s", order_type,
+                        quantity, price, market_string, e)
+            self.journal.record('risk_reject', market=market_string,
+                                type=order_type, price=price,
+                                quantity=quantity, reason=str(e))
+            return False
         if order_type == 'buy_limit':
             value = quantity
             amount = None
@@ -153,186 +304,432 @@ class OrderbookManager:
             self.api.order(order_type, price, market_string=market_string,
                            value=value, amount=amount, prevent_taker=False)
         except APIException as e:
+            self.journal.record('place_failed', market=market_string,
+                                type=order_type, price=price,
+                                quantity=quantity, error=str(e))
             if e.code == 400:
                 log.warning("Caught API error!")
-            else:
-                raise e
-
-    def check_for_rebalance(self, allocation_profile):
-        if self.prev_alloc_profile is None:
-            log.info("Rebalance! No previous rebalance data!")
-            return True
-
+                return False
+            raise e
+        self.risk.record(order_type, market_string, price, quantity)
+        self.journal.record('place', market=market_string, type=order_type,
+                            price=price, quantity=quantity)
+        return True
+
+    def check_for_rebalance(self, allocation_profile, orders):
+        """ Returns the set of markets that need to be requoted. A market's
+        drift check is only redone when its profile or the profile we last
+        placed for it changed; `orders` are get_orders' open orders, for the
+        reserve check. """
+        dirty = set()
         for market, profile in allocation_profile.items():
-            prev_profile = self.prev_alloc_profile[market]
-            for t in ('buy_limit', 'sell_limit'):
-                for n, o in zip(profile[t], prev_profile[t]):
-                    price_diff = (n[0] - o[0]) / n[0]
-                    price_tol = self.config['price_tolerance']
-                    if price_diff > price_tol:
-                        if o[0] > price_diff:
-                            log.info('Rebalance! %s %s price is %s%% higher than allotted',
-                                     market, t, price_diff.quantize(PERC)*Decimal(100))
-                        else:
-                            log.info('Rebalance! %s %s price is %s%% lower than allotted',
-                                     market, t, price_diff.quantize(PERC)*Decimal(100))
-                        return True
-                    if n[1] == 0:
-                        continue
-                    amount_diff = (n[1] - o[1]) / n[1]
-                    amount_tol = self.config['amount_tolerance']
-                    if amount_diff > amount_tol:
-                        if o[1] > amount_diff:
-                            log.info('Rebalance! %s %s amount is %s%% higher than allotted',
-                                     market, t, amount_diff.quantize(PERC)*Decimal(100))
-                        else:
-                            log.info('Rebalance! %s %s amount is %s%% lower than allotted',
-                                     market, t, amount_diff.quantize(PERC)*Decimal(100))
-                        return True
-
-        balances = self.api.balances()
-        for coin, reserve in self.config['currency_reserves'].items():
+            prev_profile = self.prev_alloc_profile.get(market)
+            if prev_profile is None:
+                log.info("Rebalance! No previous rebalance data for %s!", market)
+                self.journal.record('drift', market=market, reason='no_previous')
+                dirty.add(market)
+                continue
+            if market in self.reconfigured_markets:
+                log.info("Rebalance! %s settings changed", market)
+                self.journal.record('drift', market=market, reason='config')
+                dirty.add(market)
+                continue
+            checked = self.drift_checks.get(market)
+            if checked is not None and checked[0] is profile and checked[1] is prev_profile:
+                needs_rebalance = checked[2]
+            else:
+                needs_rebalance = self.check_market_drift(
+                    market, profile, prev_profile)
+                self.drift_checks[market] = (profile, prev_profile, needs_rebalance)
+            if needs_rebalance:
+                dirty.add(market)
+
+        if dirty.issuperset(allocation_profile):
+            return dirty
+
+        balances = self.free_balances(orders)
+        thresh = self.config.reserve_thresh_usd
+        for coin, reserve in self.config.currency_reserves.items():
+            markets = self.coin_markets().get(coin, set()) & allocation_profile.keys()
+            if dirty.issuperset(markets):
+                continue
             balance_usd = self.coin_to_usd(coin, balances.get(coin, 0))
             reserve_usd = self.coin_to_usd(coin, reserve)
-            thresh = Decimal(self.config['reserve_thresh_usd'])
             if balance_usd > reserve_usd + thresh:
                 log.info(f"Rebalance! {coin} balance_usd {balance_usd} > reserve {reserve} + thresh {thresh}.")
-                return True
-            if balance_usd < reserve_usd - thresh:
+            elif balance_usd < reserve_usd - thresh:
                 log.info(f"Rebalance! {coin} balance_usd {balance_usd} < reserve {reserve} - thresh {thresh}.")
-                return True
+            else:
+                continue
+            self.journal.record('drift', reason='reserve', coin=coin,
+                                balance_usd=balance_usd, reserve_usd=reserve_usd,
+                                markets=markets)
+            dirty.update(markets)
+        return dirty
+
+    def free_balances(self, orders):
+        """ Balances not tied up in `orders`: the merged balances this
+        cycle's compute_allocations fetched, less what each open order
+        commits, so the reserve check needs no balances() call """
+        free = {coin: Decimal(b) for coin, b in self.balances.items()}
+        for market_string, sides in orders.items():
+            market_currency, base_currency = market_string.split('_')
+            # summed in satoshis, so it's one Decimal update per side
+            buy_value = sum(o.price_sats * o.market_amount_remaining_sats
+                            for o in sides.get('buy', []))
+            sell_amount = sum(o.market_amount_remaining_sats
+                              for o in sides.get('sell', []))
+            free[base_currency] = free.get(base_currency, 0) - Decimal(buy_value).scaleb(-16)
+            free[market_currency] = free.get(market_currency, 0) - from_sats(sell_amount)
+        return free
+
+    def check_market_drift(self, market, profile, prev_profile):
+        for t in ('buy_limit', 'sell_limit'):
+            for n, o in zip(profile[t], prev_profile[t]):
+                price_diff = (n[0] - o[0]) / n[0]
+                price_tol = self.config.price_tolerance
+                if price_diff > price_tol:
+                    self.journal.record('drift', market=market, side=t,
+                                        reason='price', diff=price_diff)
+                    if o[0] > price_diff:
+                        log.info('Rebalance! %s %s price is %s%% higher than allotted',
+                                 market, t, price_diff.quantize(PERC)*Decimal(100))
+                    else:
+                        log.info('Rebalance! %s %s price is %s%% lower than allotted',
+                                 market, t, price_diff.quantize(PERC)*Decimal(100))
+                    return True
+                if n[1] == 0:
+                    continue
+                amount_diff = (n[1] - o[1]) / n[1]
+                amount_tol = self.config.amount_tolerance
+                if amount_diff > amount_tol:
+                    self.journal.record('drift', market=market, side=t,
+                                        reason='amount', diff=amount_diff)
+                    if o[1] > amount_diff:
+                        log.info('Rebalance! %s %s amount is %s%% higher than allotted',
+                                 market, t, amount_diff.quantize(PERC)*Decimal(100))
+                    else:
+                        log.info('Rebalance! %s %s amount is %s%% lower than allotted',
+                                 market, t, amount_diff.quantize(PERC)*Decimal(100))
+                    return True
         return False
 
+    def coin_markets(self):
+        """ Map of currency code to the configured markets trading it """
+        if self._coin_markets is None:
+            self._coin_markets = {}
+            for market_string, mc in self.config.markets.items():
+                for coin in (mc.market_currency, mc.base_currency):
+                    self._coin_markets.setdefault(coin, set()).add(market_string)
+        return self._coin_markets
+
     def get_orders(self):
         orders = self.api.get("/v1/user/orders")["orders"]
 
         log.debug("Updating orders...")
         sorted_orders = {}
-        for o in orders:
-            if o['open']:
-                mi = self.api.get(
-                    "/v1/market/" + str(o['market_id']))['market']
-                o['price'] = Decimal(o['price'])
-                o['market_amount_remaining'] = Decimal(
-                    o['market_amount_remaining'])
-                o['base_amount'] = o['price'] * o['market_amount_remaining']
-                market = mi['market_currency'] + '_' + mi['base_currency']
+        for raw in orders:
+            if raw['open']:
+                o = Order.parse(raw)
+                market = self.market_strings.get(o.market_id)
+                if market is None:
+                    mi = self.api.get(
+                        "/v1/market/" + str(o.market_id))['market']
+                    market = mi['market_currency'] + '_' + mi['base_currency']
+                    self.market_strings[o.market_id] = market
                 sorted_orders.setdefault(market, {'buy': [], 'sell': []})
-                if o["order_type"] == "sell_limit":
+                if o.order_type == "sell_limit":
                     sorted_orders[market]['sell'].append(o)
-                elif o["order_type"] == "buy_limit":
+                elif o.order_type == "buy_limit":
                     sorted_orders[market]['buy'].append(o)
         log.debug("Active buy orders: %s", sorted_orders)
 
+        self.risk.sync(sorted_orders)
         log.info("%s active buy orders", sum(
             [len(market['buy']) for market in sorted_orders.values()]))
         log.info("%s active sell orders", sum(
             [len(market['sell']) for market in sorted_orders.values()]))
         return sorted_orders
 
+    def quote_source(self, market):
+        for venue in QUOTE_SOURCES:
+            if market in ExchangeDatastore.tickers.get(venue, {}):
+                return venue
+        return None
+
+    def volatility_scale(self, venue, market):
+        """ How much to stretch this market's ladder given the live volatility
+        on `venue`; 1 when scaling is off or there isn't enough data yet. """
+        vs = self.config.volatility_scaling
+        if vs is None:
+            return 1
+        series = ExchangeDatastore.analytics.get(venue, {}).get(market)
+        if series is None or series.count < vs.min_samples:
+            return 1
+        vol = series.hourly_volatility
+        if vol is None:
+            return 1
+        # rounded, so that tiny volatility changes don't bust the profile cache
+        scale = Decimal(vol / vs.target_hourly_vol).quantize(SCALE)
+        return min(max(scale, vs.min_scale), vs.max_scale)
+
     def generate_orders(self, force_rebalance=False):
-        allocs = self.compute_allocations()
+        with stages.time('obm.compute_allocations'):
+            allocs = self.compute_allocations()
+        with stages.time('obm.price_markets'):
+            allocation_profile = self.price_markets(allocs)
+        with stages.time('obm.get_orders'):
+            orders = self.get_orders()
+        with stages.time('obm.rebalance_orders'):
+            self.rebalance_orders(allocation_profile, orders, force=force_rebalance)
+
+    def price_markets(self, allocs):
         allocation_profile = {}
         for market, (market_amount, base_amount) in allocs.items():
-            if 'bittrex' in ExchangeDatastore.tickers.keys() and market in ExchangeDatastore.tickers['bittrex'].keys():
-                bid = ExchangeDatastore.tickers['bittrex'][market]['bid']
-                ask = ExchangeDatastore.tickers['bittrex'][market]['ask']
-            elif 'ccxt' in ExchangeDatastore.tickers.keys() and market in ExchangeDatastore.tickers['ccxt'].keys():
-                bid = ExchangeDatastore.tickers['ccxt'][market]['bid']
-                ask = ExchangeDatastore.tickers['ccxt'][market]['ask']
-            elif 'qtrade' in ExchangeDatastore.tickers.keys() and market in ExchangeDatastore.tickers['qtrade'].keys():
-                bid = ExchangeDatastore.tickers['qtrade'][market]['bid']
-                ask = ExchangeDatastore.tickers['qtrade'][market]['ask']
-            else:
+            venue = self.quote_source(market)
+            if venue is None:
                 log.warning(f"Can't get bid/ask price for {market} to generate orders!")
                 continue
-            log.debug("Generating %s orders with bid %s and ask %s",
-                     market, bid, ask)
+            ticker = ExchangeDatastore.tickers[venue][market]
+            bid, ask = ticker.bid, ticker.ask
+            scale = self.volatility_scale(venue, market)
+            # Reuse last cycle's profile when nothing feeding it moved
+            inputs = (market_amount, base_amount, bid, ask, scale)
+            cached = self.profile_cache.get(market)
+            if cached is not None and cached[0] == inputs:
+                allocation_profile[market] = cached[1]
+                continue
+            log.debug("Generating %s orders with bid %s, ask %s and slip scale %s",
+                     market, bid, ask, scale)
             allocation_profile[market] = self.price_orders(
-                self.allocate_orders(market_amount, base_amount, market), bid, ask)
-        self.rebalance_orders(allocation_profile,
-                              self.get_orders(), force=force_rebalance)
+                self.allocate_orders(market_amount, base_amount, market),
+                bid, ask, scale)
+            self.profile_cache[market] = (inputs, allocation_profile[market])
+        return allocation_profile
 
-    def estimate_account_value(self):
-        # convert all coin values to BTC using the Bittrex bid price
+    def estimate_account_value(self, balances=None):
+        # convert all coin values to BTC along their best conversion path,
         # then convert to USD
+        if balances is None:
+            balances = self.api.balances_merged()
         total_bal = 0
-        bals = self.api.balances_merged()
-        for coin, bal in bals.items():
-            if coin == "BTC":
-                total_bal += Decimal(bal)
-            else:
-                total_bal += self.coin_to_btc(coin, bal)
+        for coin, bal in balances.items():
+            total_bal += self.coin_to_btc(coin, bal)
         return total_bal, self.btc_to_usd(total_bal).quantize(PERC)
 
     def estimate_account_gain(self, btc_bal):
-        cost_basis = Decimal(self.config['cost_basis_btc'])
+        cost_basis = self.config.cost_basis_btc
         gain = (btc_bal - cost_basis).quantize(COIN)
         return gain, self.btc_to_usd(gain).quantize(PERC)
 
     def coin_to_btc(self, coin, amt):
-        exchanges = ['qtrade']
-        for e in exchanges:
-            try:
-                bid = ExchangeDatastore.tickers[e][coin + '_BTC']['bid']
-                return (Decimal(amt) * Decimal(bid)).quantize(COIN)
-            except KeyError:
-                pass
-        log.warning("Can't get bid price for %s for price estimation", coin)
-        return 0
+        if coin == "BTC":
+            return Decimal(amt)
+        btc = self.rates.convert(coin, amt, 'BTC')
+        if btc is None:
+            log.warning("Can't get bid price for %s for price estimation", coin)
+            return 0
+        return btc.quantize(COIN)
+
+    def update_btc_price(self):
+        """ Pin qTrade's BTC price into the conversion graph, so USD values
+        don't depend on scraping a BTC/USD market """
+        price = Decimal(self.api.get('/v1/currency/BTC')
+                        ['currency']['config']['price'])
+        self.rates.set_rate('BTC', 'USD', price, venue='qtrade')
+        return price
+
+    def btc_price(self):
+        price = self.rates.rate('BTC', 'USD')
+        if price is None:
+            price = self.update_btc_price()
+        return price
 
     def btc_to_usd(self, amt):
-        btc_price = Decimal(self.api.get('/v1/currency/BTC')
-                            ['currency']['config']['price'])
-        return Decimal(amt) * btc_price
+        return Decimal(amt) * self.btc_price()
 
     def coin_to_usd(self, coin: str, amt: Union[Decimal, float]) -> Decimal:
         if coin == "BTC":
             return self.btc_to_usd(amt)
-        return self.btc_to_usd(self.coin_to_btc(coin, amt)).quantize(PERC)
+        if self.rates.rate('BTC', 'USD') is None:
+            self.update_btc_price()
+        usd = self.rates.convert(coin, amt, 'USD')
+        if usd is None:
+            log.warning("Can't get bid price for %s for price estimation", coin)
+            return Decimal(0)
+        return usd.quantize(PERC)
 
     def boot_trades(self):
-        trades = {t['id']: t for t in self.api.get('/v1/user/trades')['trades']}
+        trades = {t['id']: Trade.parse(t)
+                  for t in self.api.get('/v1/user/trades')['trades']}
         newest_ids = heapq.nlargest(10, trades.keys())
         recent_trades = {id: trades[id] for id in newest_ids}
         if len(newest_ids) != 0:
             self.most_recent_trade_id = max(newest_ids)
         else:
             self.most_recent_trade_id = 0
-        log.info("10 most recent trades:\n%s", pformat(recent_trades))
+        log.info("Tracking trades newer than %s", self.most_recent_trade_id)
+        self.journal.record('boot_trades', trades=[
+            t.to_json() for t in recent_trades.values()])
 
     def check_for_trades(self):
         res = self.api.get('/v1/user/trades', newer_than=self.most_recent_trade_id)
         if res['trades'] == []:
             log.info('No new trades!')
             return
-        trades = {t['id']: t for t in res['trades']}
-        if self.config['dry_run_mode'] is False:
-            log.info("Bot made new trades:\n%s", pformat(trades))
+        trades = {t['id']: Trade.parse(t) for t in res['trades']}
+        for t in trades.values():
+            self.journal.record('fill', market=t.market_string, trade=t.to_json())
+        if self.config.dry_run_mode is False:
+            log.info("Bot made %s new trades", len(trades))
             return True
         self.most_recent_trade_id = max(trades.keys())
         return False
 
+    def checkpoint(self):
+        """ Persist what a restart needs to pick up where we left off """
+        path = self.config.state_path
+        if path is None:
+            return
+        state = {
+            'saved_at': time.time(),
+            'most_recent_trade_id': self.most_recent_trade_id,
+            'prev_alloc_profile': {
+                market: {t: [[str(p), str(q)] for p, q in profile[t]]
+                         for t, _ in SIDES}
+                for market, profile in self.prev_alloc_profile.items()},
+        }
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        # a crash mid-write must never leave a truncated checkpoint behind
+        os.replace(tmp, path)
+
+    def restore(self):
+        """ Warm start from the last checkpoint. Markets whose live orders
+        still sit at the prices of the profile we placed keep them (order
+        ids aren't needed, and get_orders lists them before we requote, so
+        they'd be stale anyway); the rest come up dirty
+        and get requoted on the first cycle. Returns False for a cold start. """
+        path = self.config.state_path
+        if path is None:
+            return False
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            log.info("No checkpoint at %s, cold start", path)
+            return False
+        except ValueError:
+            log.warning("Unreadable checkpoint at %s, cold start", path)
+            return False
+
+        self.most_recent_trade_id = state['most_recent_trade_id']
+        live = self.get_orders()
+        kept = []
+        for market, raw in state['prev_alloc_profile'].items():
+            if market not in self.config.markets:
+                continue
+            profile = {t: [(Decimal(p), Decimal(q)) for p, q in raw[t]]
+                       for t, _ in SIDES}
+            if self.orders_match(profile, live.get(market, {})):
+                self.prev_alloc_profile[market] = profile
+                kept.append(market)
+        log.info("Warm start from %s: keeping resting orders on %s of %s "
+                 "markets", path, len(kept), len(self.config.markets))
+        self.journal.record('restore', kept=kept,
+                            checkpoint_age=time.time() - state['saved_at'])
+        return self.most_recent_trade_id is not None
+
+    def orders_match(self, profile, market_orders):
+        """ Partially filled orders still count, but a filled, cancelled or
+        foreign order means the market needs requoting """
+        for t, side in SIDES:
+            placed = sorted(p for p, q in profile[t] if q > 0)
+            resting = sorted(o.price for o in market_orders.get(side, []))
+            if placed != resting:
+                return False
+        return True
+
+    def cycle(self):
+        """ One pass of the monitor loop """
+        start = time.perf_counter()
+        self.apply_config()
+        self.update_btc_price()
+        self.generate_orders()
+        with stages.time('obm.checkpoint'):
+            self.checkpoint()
+        btc_val, usd_val = self.estimate_account_value(self.balances)
+        self.risk.mark_value(btc_val, self.config.cost_basis_btc)
+        took = time.perf_counter() - start
+        stages.add('obm.cycle', took)
+        if took > self.config.monitor_period:
+            log.warning("Cycle took %.1fs, longer than the %ss monitor "
+                        "period; `main.py introspect` shows the slow stages",
+                        took, self.config.monitor_period)
+        log.info("Current account value is about $%s, %s BTC",
+                 usd_val, btc_val)
+        btc_gain, usd_gain = self.estimate_account_gain(btc_val)
+        log.info("The bot has earned $%s, %s BTC",
+                 usd_gain, btc_gain)
+
+    def abort(self):
+        """ Just in case the entire program explodes, so that we don't have
+        orders out """
+        self.api.cancel_market_orders()
+        self.risk.clear()
+        self.journal.record('cancel_all', reason='failures')
+        # nothing is resting any more, so requote everything
+        self.prev_alloc_profile = {}
+        self.checkpoint()
+
+    def start(self):
+        try:
+            warm = self.restore()
+        except Exception:
+            # eg. get_orders failed, or a checkpoint from an older version
+            log.warning("Couldn't restore from the checkpoint, cold start",
+                        exc_info=True)
+            self.prev_alloc_profile = {}
+            self.most_recent_trade_id = None
+            warm = False
+        if not warm:
+            self.boot_trades()
+
     async def monitor(self):
         # Sleep to allow data scrapers to populate
         await asyncio.sleep(2)
         log.info("Starting orderbook manager; interval period %s sec",
-                 self.config['monitor_period'])
-        self.boot_trades()
+                 self.config.monitor_period)
+        # Cycles make dozens of blocking API calls; running them on a worker
+        # thread keeps the event loop free, and lets them queue in the
+        # gateway behind the collector's and vol bot's calls by priority
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.start)
+                break
+            except Exception:
+                log.warning("Orderbook manager failed to start, retrying",
+                            exc_info=True)
+                await asyncio.sleep(self.config.monitor_period)
+        failures = 0
         while True:
             try:
-                self.generate_orders()
-                btc_val, usd_val = self.estimate_account_value()
-                log.info("Current account value is about $%s, %s BTC",
-                         usd_val, btc_val)
-                btc_gain, usd_gain = self.estimate_account_gain(btc_val)
-                log.info("The bot has earned $%s, %s BTC",
-                         usd_gain, btc_gain)
-                await asyncio.sleep(self.config['monitor_period'])
+                await loop.run_in_executor(None, self.cycle)
+                failures = 0
+                await asyncio.sleep(self.config.monitor_period)
             except Exception:
-                log.warning("Orderbook manager loop exploded", exc_info=True)
-                # Just in case the entire program explodes, so that we don't have orders out.
+                failures += 1
+                log.warning("Orderbook manager loop exploded (%s in a row)",
+                            failures, exc_info=True)
+                if failures < self.config.max_cycle_failures:
+                    await asyncio.sleep(self.config.monitor_period)
+                    continue
                 try:
-                    self.api.cancel_market_orders()
+                    await loop.run_in_executor(None, self.abort)
                 except Exception:
                     log.warning("Failed to cancel orders on abort recovery", exc_info=True)
+                # give whatever broke a full period before trying again
+                failures = 0
+                await asyncio.sleep(self.config.monitor_period)
@@ -0,0 +1,83 @@
+import time
+import logging
+import importlib
+from importlib.metadata import entry_points
+
+log = logging.getLogger('plugins')
+
+# Built-in plugins as "module:attribute" paths, so that nothing is imported
+# until a command actually needs it
+SCRAPERS = {
+    "qtrade": "market_scrapers:QTradeScraper",
+    "bittrex": "market_scrapers:BittrexScraper",
+    "ccxt": "market_scrapers:CCXTScraper",
+}
+
+BOTS = {
+    "mdc": "market_data_collector:MarketDataCollector",
+    "obm": "orderbook_manager:OrderbookManager",
+    "vol": "vol_bot:VolBot",
+}
+
+KINDS = {
+    "scrapers": ("lpbot.scrapers", SCRAPERS),
+    "bots": ("lpbot.bots", BOTS),
+}
+
+
+class PluginRegistry:
+    """ Resolves scraper and bot names to classes, importing their modules
+    only on first lookup. Built-ins can be overridden or extended by
+    `lpbot.scrapers`/`lpbot.bots` entry points, and those in turn by the
+    optional `plugins` section of config.yml:
+
+    plugins:
+      scrapers:
+        kraken: my_scrapers:KrakenScraper
+    """
+
+    def __init__(self, config=None):
+        self.config = config or {}
+        self.paths = None
+        self.loaded = {}
+
+    def discover(self):
+        # reading package metadata isn't free, so only do it on first lookup
+        self.paths = {}
+        for kind, (group, builtins) in KINDS.items():
+            paths = self.paths[kind] = dict(builtins)
+            for ep in entry_points(group=group):
+                paths[ep.name] = ep.value
+            paths.update(self.config.get(kind, {}))
+
+    def load(self, kind, name):
+        if (kind, name) in self.loaded:
+            return self.loaded[(kind, name)]
+        if self.paths is None:
+            self.discover()
+        try:
+            path = self.paths[kind][name]
+        except KeyError:
+            raise KeyError("Unknown {} plugin {!r}".format(kind, name))
+        module, _, attr = path.partition(':')
+        start = time.perf_counter()
+        obj = getattr(importlib.import_module(module), attr)
+        log.debug("Loaded %s plugin %s from %s in %.3fs",
+                  kind, name, path, time.perf_counter() - start)
+        self.loaded[(kind, name)] = obj
+        return obj
+
+
+class LazyComponents(dict):
+    """ Dict of components that are constructed on first access from
+    `factories`, a map of name to a callable taking this dict. """
+
+    def __init__(self, factories):
+        super().__init__()
+        self.factories = factories
+
+    def __missing__(self, name):
+        start = time.perf_counter()
+        self[name] = self.factories[name](self)
+        log.debug("Built %s in %.3fs", name, time.perf_counter() - start)
+        return self[name]
@@ -0,0 +1,123 @@
+import time
+import heapq
+import itertools
+import logging
+
+log = logging.getLogger('scheduler')
+
+
+class PollTarget:
+    """ One (venue, market) pair with its own polling interval """
+
+    def __init__(self, scraper, market, qmarket, interval):
+        self.scraper = scraper
+        self.market = market
+        self.qmarket = qmarket
+        self.interval = interval
+        self.base_interval = interval
+        self.next_due = 0
+        self.last_mid = None
+        self.polls = 0
+        self.errors = 0
+        # on the scheduler's heap, rather than popped for polling
+        self.queued = False
+
+    @property
+    def venue(self):
+        return self.scraper.exchange_name
+
+
+class PollScheduler:
+    """ Gives every (venue, market) its own adaptive polling interval.
+
+    After each poll the interval shrinks by `speedup` if the midpoint moved
+    by at least `fast_move`, grows by `backoff` if it moved less than
+    `quiet_move`, and grows by `error_backoff` if the scrape failed. It also
+    grows by `backoff` while the venue has less than `min_headroom` of its
+    rate limit budget left. Once polls succeed again with headroom to spare,
+    an interval that was pushed out past its starting value shrinks back
+    towards it by `speedup`. Intervals stay within [min_interval,
+    max_interval].
+    """
+
+    def __init__(self, scrapers, config, initial_interval):
+        self.config = config
+        self.targets = []
+        self.heap = []
+        self.seq = itertools.count()
+        for s in scrapers:
+            for market, qmarket in s.markets.items():
+                target = PollTarget(s, market, qmarket, self.clamp(initial_interval))
+                self.targets.append(target)
+                self.push(target)
+
+    def clamp(self, interval):
+        return min(max(interval, self.config['min_interval']),
+                   self.config['max_interval'])
+
+    def push(self, target):
+        heapq.heappush(self.heap, (target.next_due, next(self.seq), target))
+        target.queued = True
+
+    def next_due(self):
+        """ Seconds until the soonest queued target is due, or None when
+        every target is being polled (or there are none) """
+        if not self.heap:
+            return None
+        return max(self.heap[0][0] - time.monotonic(), 0)
+
+    def pop(self):
+        """ Take the soonest queued target off the heap for polling """
+        _, _, target = heapq.heappop(self.heap)
+        target.queued = False
+        return target
+
+    def release(self, target):
+        """ Put back a target whose poll died before `record` rescheduled it,
+        so it isn't dropped from polling for good """
+        if target.queued:
+            return
+        target.next_due = time.monotonic() + target.interval
+        self.push(target)
+
+    def record(self, target, mid):
+        """ Reschedule `target` after a poll; `mid` is None if it failed """
+        cfg = self.config
+        target.polls += 1
+        interval = target.interval
+        starved = target.scraper.headroom() < cfg['min_headroom']
+        if mid is None:
+            target.errors += 1
+            interval *= cfg['error_backoff']
+        else:
+            if target.last_mid:
+                move = abs(mid - target.last_mid) / target.last_mid
+                if move >= cfg['fast_move']:
+                    interval *= cfg['speedup']
+                elif move < cfg['quiet_move']:
+                    interval *= cfg['backoff']
+                elif not starved and interval > target.base_interval:
+                    # pushed out by errors or a rate limit squeeze that's over
+                    interval = max(interval * cfg['speedup'],
+                                   target.base_interval)
+            target.last_mid = mid
+        if starved:
+            interval *= cfg['backoff']
+        target.interval = self.clamp(interval)
+        target.next_due = time.monotonic() + target.interval
+        self.push(target)
+
+    def metrics(self):
+        """ {venue: {market: {'interval', 'polls', 'errors'}}} """
+        metrics = {}
+        for t in self.targets:
+            metrics.setdefault(t.venue, {})[t.qmarket] = {
+                'interval': t.interval, 'polls': t.polls, 'errors': t.errors}
+        return metrics
+
+    def report(self):
+        for venue, markets in self.metrics().items():
+            log.info("%s polling intervals: %s", venue, ', '.join(
+                "{} {:.1f}s ({} polls, {} errors)".format(
+                    m, v['interval'], v['polls'], v['errors'])
+                for m, v in sorted(markets.items())))
@@ -0,0 +1,118 @@
+import json
+import time
+import random
+import tracemalloc
+from decimal import Decimal
+
+import click
+
+from records import Ticker, Order, Trade, fmt_sats
+
+COIN = Decimal('.00000001')
+
+
+def payloads(n, seed=1):
+    """ JSON shaped like qTrade's ticker, order and trade responses """
+    rng = random.Random(seed)
+    tickers, orders, trades = [], [], []
+    for i in range(n):
+        price = rng.randrange(10, 10 ** 6)
+        tickers.append({"bid": fmt_sats(price - 5), "last": fmt_sats(price),
+                        "ask": fmt_sats(price + 5)})
+        orders.append({
+            "id": i, "market_id": i % 50 + 1,
+            "order_type": rng.choice(("buy_limit", "sell_limit")),
+            "price": fmt_sats(price), "market_amount": fmt_sats(10 ** 9),
+            "market_amount_remaining": fmt_sats(rng.randrange(10 ** 9)),
+            "base_amount": fmt_sats(price * 10), "open": True,
+            "created_at": "2019-11-14T23:03:39.000000Z", "trades": None})
+        trades.append({
+            "id": i, "order_id": i, "market_id": i % 50 + 1,
+            "market_string": "LTC_BTC", "side": "buy", "taker": False,
+            "price": fmt_sats(price), "market_amount": fmt_sats(10 ** 8),
+            "base_amount": fmt_sats(price), "base_fee": fmt_sats(price // 400),
+            "created_at": "2019-11-14T23:03:39.000000Z"})
+    return {'ticker': json.dumps(tickers), 'order': json.dumps(orders),
+            'trade': json.dumps(trades)}
+
+
+# How the bot kept each kind before records.py: the parsed JSON dict with
+# Decimal fields swapped in
+def dict_ticker(raw):
+    return {"bid": Decimal(raw["bid"]).quantize(COIN),
+            "last": Decimal(raw["last"]).quantize(COIN),
+            "ask": Decimal(raw["ask"]).quantize(COIN)}
+
+
+def dict_order(raw):
+    raw['price'] = Decimal(raw['price'])
+    raw['market_amount_remaining'] = Decimal(raw['market_amount_remaining'])
+    raw['base_amount'] = raw['price'] * raw['market_amount_remaining']
+    return raw
+
+
+def dict_trade(raw):
+    return raw
+
+
+KINDS = {
+    'ticker': (dict_ticker, Ticker.parse,
+               lambda t: t['bid'] + t['ask'], lambda t: t.bid_sats + t.ask_sats),
+    'order': (dict_order, Order.parse,
+              lambda o: o['price'], lambda o: o.price_sats),
+    'trade': (dict_trade, Trade.parse,
+              lambda t: Decimal(t['market_amount']), lambda t: t.market_amount_sats),
+}
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def measure(payload, parse, field, repeat):
+    """ Parse time, bytes retained per record, and the time to read one
+    field off every record """
+    parse_s = timed(lambda: [parse(r) for r in json.loads(payload)], repeat)
+
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    raws = json.loads(payload)
+    records = [parse(r) for r in raws]
+    # whatever the records don't hold on to is freed
+    del raws
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    scan_s = timed(lambda: sum(field(r) for r in records), repeat)
+    n = len(records)
+    return {'parse_us': parse_s / n * 1e6, 'bytes': (used - base) / n,
+            'scan_us': scan_s / n * 1e6}
+
+
+@click.command()
+@click.option('--count', '-n', default=100000, help='records of each kind')
+@click.option('--repeat', '-r', default=5)
+def main(count, repeat):
+    """ Compare records.py against the dicts it replaced """
+    data = payloads(count)
+    print("{:<8} {:<7} {:>10} {:>12} {:>10}".format(
+        'kind', 'as', 'parse us', 'bytes/rec', 'scan us'))
+    for kind, (dict_parse, record_parse, dict_field, record_field) in KINDS.items():
+        rows = [('dict', measure(data[kind], dict_parse, dict_field, repeat)),
+                ('record', measure(data[kind], record_parse, record_field, repeat))]
+        for name, r in rows:
+            print("{:<8} {:<7} {:>10.2f} {:>12.0f} {:>10.3f}".format(
+                kind, name, r['parse_us'], r['bytes'], r['scan_us']))
+        old, new = rows[0][1], rows[1][1]
+        print("{:<8} {:<7} {:>9.2f}x {:>11.2f}x {:>9.2f}x".format(
+            kind, 'ratio', new['parse_us'] / old['parse_us'],
+            new['bytes'] / old['bytes'], new['scan_us'] / old['scan_us']))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+from collections import namedtuple
+from decimal import Decimal
+
+COIN = Decimal('.00000001')
+SATS = 100000000
+ONE_SAT = Decimal('1E-8')
+
+
+def to_sats(value):
+    """ Price or amount as an integer number of 1e-8 units. Strings are
+    exact; floats (eg. from Bittrex or ccxt) round to the nearest unit. """
+    if isinstance(value, str) and value[-9:-8] == '.':
+        # '123.45678900' is what the exchange sends, and dropping the point
+        # is several times quicker than going through Decimal
+        try:
+            return int(value.replace('.', '', 1))
+        except ValueError:
+            pass
+    return int(Decimal(value).quantize(COIN).scaleb(8))
+
+
+def from_sats(sats):
+    return Decimal(sats) * ONE_SAT
+
+
+def fmt_sats(sats):
+    """ 12345 -> '0.00012345', the way the exchange formats amounts """
+    sign = '-' if sats < 0 else ''
+    whole, frac = divmod(abs(sats), SATS)
+    return "{}{}.{:08d}".format(sign, whole, frac)
+
+
+class Ticker(namedtuple('Ticker', ['bid_sats', 'last_sats', 'ask_sats'])):
+    """ Top of book for one market, in satoshis of the base currency """
+    __slots__ = ()
+
+    @classmethod
+    def parse(cls, raw):
+        """ From a ticker's JSON, eg. qTrade's /v1/ticker/<market> """
+        return cls._make((to_sats(raw['bid']), to_sats(raw['last']),
+                          to_sats(raw['ask'])))
+
+    @classmethod
+    def from_prices(cls, bid, last, ask):
+        return cls._make((to_sats(bid), to_sats(last), to_sats(ask)))
+
+    @property
+    def bid(self):
+        return from_sats(self.bid_sats)
+
+    @property
+    def last(self):
+        return from_sats(self.last_sats)
+
+    @property
+    def ask(self):
+        return from_sats(self.ask_sats)
+
+    def to_json(self):
+        return {'bid': fmt_sats(self.bid_sats), 'last': fmt_sats(self.last_sats),
+                'ask': fmt_sats(self.ask_sats)}
+
+
+class Order(namedtuple('Order', [
+        'id', 'market_id', 'order_type', 'price_sats',
+        'market_amount_remaining_sats'])):
+    """ The parts of an open order the bot works with """
+    __slots__ = ()
+
+    @classmethod
+    def parse(cls, raw):
+        """ From an order in qTrade's /v1/user/orders """
+        return cls._make((raw['id'], raw['market_id'], raw['order_type'],
+                          to_sats(raw['price']),
+                          to_sats(raw['market_amount_remaining'])))
+
+    @property
+    def price(self):
+        return from_sats(self.price_sats)
+
+    @property
+    def market_amount_remaining(self):
+        return from_sats(self.market_amount_remaining_sats)
+
+    @property
+    def base_amount(self):
+        return self.price * self.market_amount_remaining
+
+    def to_json(self):
+        return {'id': self.id, 'market_id': self.market_id,
+                'order_type': self.order_type,
+                'price': fmt_sats(self.price_sats),
+                'market_amount_remaining': fmt_sats(self.market_amount_remaining_sats)}
+
+
+class Trade(namedtuple('Trade', [
+        'id', 'order_id', 'market_id', 'market_string', 'side', 'taker',
+        'price_sats', 'market_amount_sats', 'base_amount_sats',
+        'base_fee_sats', 'created_at'])):
+    """ One of our fills from qTrade's /v1/user/trades """
+    __slots__ = ()
+
+    @classmethod
+    def parse(cls, raw):
+        return cls._make((
+            raw['id'], raw.get('order_id'), raw.get('market_id'),
+            raw.get('market_string'), raw.get('side'), raw.get('taker'),
+            to_sats(raw['price']), to_sats(raw['market_amount']),
+            to_sats(raw['base_amount']), to_sats(raw.get('base_fee') or '0.00000000'),
+            raw.get('created_at')))
+
+    @property
+    def price(self):
+        return from_sats(self.price_sats)
+
+    @property
+    def market_amount(self):
+        return from_sats(self.market_amount_sats)
+
+    @property
+    def base_amount(self):
+        return from_sats(self.base_amount_sats)
+
+    @property
+    def base_fee(self):
+        return from_sats(self.base_fee_sats)
+
+    def to_json(self):
+        return {'id': self.id, 'order_id': self.order_id,
+                'market_id': self.market_id, 'market_string': self.market_string,
+                'side': self.side, 'taker': self.taker,
+                'price': fmt_sats(self.price_sats),
+                'market_amount': fmt_sats(self.market_amount_sats),
+                'base_amount': fmt_sats(self.base_amount_sats),
+                'base_fee': fmt_sats(self.base_fee_sats),
+                'created_at': self.created_at}
@@ -0,0 +1,288 @@
+import time
+import logging
+import threading
+from collections import deque, namedtuple
+from decimal import Decimal
+
+from data_classes import ExchangeDatastore
+from market_config import ConfigError, to_decimal
+from records import from_sats
+
+log = logging.getLogger('risk')
+
+
+class RiskRejected(Exception):
+    pass
+
+
+class RiskLimits(namedtuple('RiskLimits', [
+        'max_market_notional_btc', 'max_total_notional_btc',
+        'max_currency_exposure', 'max_orders_per_sec', 'max_drawdown'])):
+    """ Compiled `risk` config section; a limit left out is not enforced """
+    __slots__ = ()
+
+    @classmethod
+    def compile(cls, raw):
+        raw = raw or {}
+
+        def limit(key):
+            if raw.get(key) is None:
+                return None
+            return to_decimal(raw[key], key, minimum=0)
+        try:
+            exposure = {coin: to_decimal(v, coin + " exposure limit", minimum=0)
+                        for coin, v in (raw.get('max_currency_exposure') or {}).items()}
+        except AttributeError:
+            raise ConfigError("max_currency_exposure must be a map of coin: amount")
+        max_rate = raw.get('max_orders_per_sec')
+        if max_rate is not None:
+            # compared against a count of orders, so below 1 would block all
+            max_rate = int(to_decimal(max_rate, 'max_orders_per_sec', minimum=1))
+        return cls(
+            max_market_notional_btc=limit('max_market_notional_btc'),
+            max_total_notional_btc=limit('max_total_notional_btc'),
+            max_currency_exposure=exposure,
+            max_orders_per_sec=max_rate,
+            max_drawdown=limit('max_drawdown'))
+
+
+class ExposureLedger:
+    """ Running totals of what our open orders commit, updated as orders are
+    placed and cancelled rather than recomputed from the exchange.
+
+    Buys commit base currency (their value) and sells commit market
+    currency (their amount). Market notional is in BTC, converted at the
+    rate when the order was placed; `sync` rebuilds everything from the
+    order list get_orders fetches every cycle, which also soaks up fills
+    and rate drift. """
+
+    def __init__(self, rates=None):
+        self.rates = rates or ExchangeDatastore.rates
+        # market -> [base committed, market committed, notional btc]
+        self.markets = {}
+        self.currencies = {}
+        self.total_notional_btc = Decimal(0)
+
+    @staticmethod
+    def split(market_string):
+        market_currency, base_currency = market_string.split('_')
+        return market_currency, base_currency
+
+    def to_btc(self, coin, amt):
+        if coin == 'BTC':
+            return amt
+        rate = self.rates.rate(coin, 'BTC')
+        # unknown coins count as worthless rather than blocking trading
+        return amt * rate if rate is not None else Decimal(0)
+
+    def effect(self, side, market_string, price, quantity):
+        """ (coin committed, amount, notional btc) of one order """
+        market_currency, base_currency = self.split(market_string)
+        if side == 'buy':
+            return base_currency, quantity, self.to_btc(base_currency, quantity)
+        return (market_currency, quantity,
+                self.to_btc(base_currency, quantity * price))
+
+    def apply(self, side, market_string, price, quantity, sign=1):
+        coin, amount, notional = self.effect(side, market_string, price, quantity)
+        if side == 'buy':
+            self.add(market_string, sign * amount, 0, sign * notional)
+        else:
+            self.add(market_string, 0, sign * amount, sign * notional)
+
+    def add(self, market_string, base_amount, market_amount, notional):
+        market_currency, base_currency = self.split(market_string)
+        entry = self.markets.setdefault(market_string, [Decimal(0)] * 3)
+        entry[0] += base_amount
+        entry[1] += market_amount
+        entry[2] += notional
+        self.currencies[base_currency] = self.currencies.get(base_currency, 0) + base_amount
+        self.currencies[market_currency] = self.currencies.get(market_currency, 0) + market_amount
+        self.total_notional_btc += notional
+
+    def copy(self):
+        ledger = ExposureLedger(self.rates)
+        ledger.markets = {m: list(entry) for m, entry in self.markets.items()}
+        ledger.currencies = dict(self.currencies)
+        ledger.total_notional_btc = self.total_notional_btc
+        return ledger
+
+    def clear_market(self, market_string):
+        entry = self.markets.pop(market_string, None)
+        if entry is None:
+            return
+        market_currency, base_currency = self.split(market_string)
+        self.currencies[base_currency] -= entry[0]
+        self.currencies[market_currency] -= entry[1]
+        self.total_notional_btc -= entry[2]
+
+    def clear(self):
+        self.markets.clear()
+        self.currencies.clear()
+        self.total_notional_btc = Decimal(0)
+
+    def sync(self, open_orders):
+        """ Rebuild from get_orders' {market: {'buy': [Order], 'sell': [...]}} """
+        self.clear()
+        for market_string, sides in open_orders.items():
+            # summed in satoshis first, so it's one Decimal update per market
+            buy_value = sum(o.price_sats * o.market_amount_remaining_sats
+                            for o in sides.get('buy', []))
+            sell_value = sum(o.price_sats * o.market_amount_remaining_sats
+                             for o in sides.get('sell', []))
+            sell_amount = sum(o.market_amount_remaining_sats
+                              for o in sides.get('sell', []))
+            _, base_currency = self.split(market_string)
+            self.add(market_string, Decimal(buy_value).scaleb(-16),
+                     from_sats(sell_amount), self.to_btc(
+                         base_currency, Decimal(buy_value + sell_value).scaleb(-16)))
+
+
+class RiskManager:
+    """ Pre-trade checks both bots run before sending an order. Every check
+    reads running totals from the ExposureLedger, so it costs a few dict
+    lookups and no API calls; `check` raises RiskRejected with the reason.
+    The bots call it from different threads, so the ledger is only touched
+    under `lock`. """
+
+    def __init__(self, config, rates=None):
+        self.limits = config if isinstance(config, RiskLimits) else RiskLimits.compile(config)
+        self.ledger = ExposureLedger(rates)
+        # send times of recent orders, for the rate limit
+        self.sent = deque()
+        self.drawdown = Decimal(0)
+        self.rejected = 0
+        self.lock = threading.RLock()
+        # order id -> (side, market, price, quantity) of orders recorded
+        # since the ledger was last rebuilt, so `release` only takes out
+        # what's still counted
+        self.recorded = {}
+
+    @staticmethod
+    def side(order_type):
+        # the orderbook manager says buy_limit, the vol bot just buy
+        return 'buy' if order_type.startswith('buy') else 'sell'
+
+    def check(self, order_type, market_string, price, quantity, now=None):
+        with self.lock:
+            limits = self.limits
+            if limits.max_orders_per_sec is not None:
+                now = time.monotonic() if now is None else now
+                while self.sent and self.sent[0] <= now - 1:
+                    self.sent.popleft()
+                if len(self.sent) >= limits.max_orders_per_sec:
+                    raise self.reject("{} orders in the last second".format(len(self.sent)))
+            self.check_exposure(self.ledger, order_type, market_string, price, quantity)
+
+    def check_ladders(self, ladders):
+        """ Check requotes before anything is cancelled. `ladders` maps
+        market -> [(order_type, price, quantity)] that would replace its
+        resting orders; each is checked on top of the ones before it, as if
+        they had all been placed. Returns {market: reason} for those that
+        wouldn't pass, without recording anything. The orders per second
+        limit isn't checked, as it depends on when the orders go out. """
+        rejected = {}
+        with self.lock:
+            ledger = self.ledger.copy()
+            for market_string, orders in ladders.items():
+                trial = ledger.copy()
+                trial.clear_market(market_string)
+                try:
+                    for order_type, price, quantity in orders:
+                        self.check_exposure(trial, order_type, market_string,
+                                            price, quantity)
+                        trial.apply(self.side(order_type), market_string,
+                                    Decimal(price), Decimal(quantity))
+                except RiskRejected as e:
+                    rejected[market_string] = str(e)
+                    continue
+                ledger = trial
+        return rejected
+
+    def check_exposure(self, ledger, order_type, market_string, price, quantity):
+        limits = self.limits
+        side = self.side(order_type)
+        try:
+            coin, amount, notional = ledger.effect(
+                side, market_string, Decimal(price), Decimal(quantity))
+        except ValueError:
+            raise self.reject("{} isn't a MARKET_BASE market".format(market_string))
+
+        if limits.max_drawdown is not None and self.drawdown > limits.max_drawdown:
+            raise self.reject("drawdown {:.2%} is past {:.2%}".format(
+                self.drawdown, limits.max_drawdown))
+
+        max_coin = limits.max_currency_exposure.get(coin)
+        if max_coin is not None:
+            committed = ledger.currencies.get(coin, 0) + amount
+            if committed > max_coin:
+                raise self.reject("{} {} would be committed, limit {}".format(
+                    committed, coin, max_coin))
+
+        if limits.max_market_notional_btc is not None:
+            entry = ledger.markets.get(market_string)
+            total = (entry[2] if entry else 0) + notional
+            if total > limits.max_market_notional_btc:
+                raise self.reject("{} notional would be {} BTC, limit {}".format(
+                    market_string, total, limits.max_market_notional_btc))
+
+        if limits.max_total_notional_btc is not None:
+            total = ledger.total_notional_btc + notional
+            if total > limits.max_total_notional_btc:
+                raise self.reject("total notional would be {} BTC, limit {}".format(
+                    total, limits.max_total_notional_btc))
+
+    def reject(self, reason):
+        self.rejected += 1
+        return RiskRejected(reason)
+
+    def record(self, order_type, market_string, price, quantity, now=None,
+               order_id=None):
+        """ An order passed its checks and was sent; pass its `order_id` to
+        be able to `release` it """
+        side = self.side(order_type)
+        price, quantity = Decimal(price), Decimal(quantity)
+        with self.lock:
+            if self.limits.max_orders_per_sec is not None:
+                self.sent.append(time.monotonic() if now is None else now)
+            self.ledger.apply(side, market_string, price, quantity)
+            if order_id is not None:
+                self.recorded[order_id] = (side, market_string, price, quantity)
+
+    def release(self, order_id):
+        """ A recorded order is no longer resting, eg. a vol bot fill-or-kill
+        that filled or was killed. A sync or clear since it was recorded
+        already rebuilt the ledger from the exchange, so then there's
+        nothing to take out. """
+        with self.lock:
+            entry = self.recorded.pop(order_id, None)
+            if entry is None:
+                return False
+            side, market_string, price, quantity = entry
+            self.ledger.apply(side, market_string, price, quantity, sign=-1)
+            return True
+
+    def clear_market(self, market_string):
+        with self.lock:
+            self.ledger.clear_market(market_string)
+            self.recorded = {i: o for i, o in self.recorded.items()
+                             if o[1] != market_string}
+
+    def clear(self):
+        with self.lock:
+            self.ledger.clear()
+            self.recorded.clear()
+
+    def sync(self, open_orders):
+        with self.lock:
+            self.ledger.sync(open_orders)
+            self.recorded.clear()
+
+    def mark_value(self, btc_value, cost_basis_btc):
+        """ Track drawdown from the account value the orderbook manager
+        estimates every cycle """
+        if cost_basis_btc > 0:
+            self.drawdown = max((cost_basis_btc - Decimal(btc_value)) / cost_basis_btc, 0)
+        if self.limits.max_drawdown is not None and self.drawdown > self.limits.max_drawdown:
+            log.warning("Drawdown %.2f%% is past the %.2f%% limit, not placing orders",
+                        self.drawdown * 100, self.limits.max_drawdown * 100)
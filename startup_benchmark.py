@@ -0,0 +1,94 @@
+import os
+import sys
+import json
+import time
+import statistics
+import subprocess
+import tempfile
+
+import click
+
+# Components each subcommand touches; they're built but the command itself
+# isn't run, so nothing is sent to the exchange
+COMMAND_COMPONENTS = {
+    'run': ['obm', 'mdc', 'api', 'reloader', 'risk', 'introspector'],
+    'mdc': ['mdc'],
+    'obm': ['obm', 'reloader', 'risk'],
+    'vol': ['vol', 'risk'],
+    'balances_test': ['api'],
+    'compute_allocations_test': ['obm'],
+    'allocate_orders_test': ['obm'],
+    'price_orders_test': ['obm'],
+    'update_orders_test': ['obm'],
+    'cancel_all': ['api'],
+    'rebalance_test': ['mdc', 'obm'],
+    'estimate_account_value': ['mdc', 'obm'],
+    'estimate_account_gain': ['mdc', 'obm'],
+    'trade_tracking_test': ['obm'],
+    'introspect': ['config'],
+}
+
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import main
+cmd, config, keyfile, components = sys.argv[1:5]
+timings = {}
+
+def probe(ctx, **params):
+    timings['ready'] = time.perf_counter() - start
+    for name in components.split(','):
+        ctx.obj[name]
+    timings['built'] = time.perf_counter() - start
+    print(json.dumps(timings))
+
+# newer click versions register cancel_all as cancel-all
+command = next(c for c in main.cli.commands.values()
+               if c.callback.__name__ == cmd)
+command.callback = main.click.pass_context(probe)
+main.cli(['-c', config, '-f', keyfile, command.name], obj={},
+         standalone_mode=False)
+"""
+
+
+def probe(cmd, config, keyfile):
+    start = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, '-c', PROBE, cmd, config, keyfile,
+         ','.join(COMMAND_COMPONENTS[cmd])],
+        capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if out.returncode != 0:
+        raise click.ClickException("{} failed:\n{}".format(cmd, out.stderr))
+    timings = json.loads(out.stdout.strip().splitlines()[-1])
+    timings['wall'] = wall
+    return timings
+
+
+@click.command()
+@click.option('--config', '-c', default="config.yml")
+@click.option('--repeat', '-r', default=5)
+@click.argument('commands', nargs=-1)
+def main(config, repeat, commands):
+    """ Time how long each subcommand takes to start, in a fresh interpreter
+    per run. `ready` is import plus the cli group callback, `built` adds
+    constructing the components the command uses, `wall` is the whole
+    process including interpreter startup. """
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+        f.write("1:0000000000000000000000000000000000000000000000000000000000000000\n")
+        keyfile = f.name
+
+    try:
+        print("{:<26} {:>9} {:>9} {:>9}".format(
+            'command', 'ready ms', 'built ms', 'wall ms'))
+        for cmd in commands or COMMAND_COMPONENTS:
+            runs = [probe(cmd, config, keyfile) for _ in range(repeat)]
+            print("{:<26} {:>9.1f} {:>9.1f} {:>9.1f}".format(cmd, *(
+                statistics.median(r[k] for r in runs) * 1000
+                for k in ('ready', 'built', 'wall'))))
+    finally:
+        os.unlink(keyfile)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import os
+import sys
+import threading
+
+import pytest
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the bot's modules live at the top of the repo rather than in a package
+sys.path.insert(0, ROOT)
+
+import exchange_sim  # noqa: E402
+
+
+@pytest.fixture
+def config():
+    """ A fresh copy of config.yml for each test to tweak """
+    with open(os.path.join(ROOT, 'config.yml')) as f:
+        return yaml.safe_load(f)
+
+
+@pytest.fixture
+def sim(config):
+    """ exchange_sim on a free port, with no latency, injected errors or rate
+    limiting. The market only moves when a test calls `sim.sim.step()`. """
+    cfg = dict(config['exchange_sim'], latency=0, latency_jitter=0,
+               error_rate=0, rate_limit=10000, burst=10000)
+    server = exchange_sim.make_server(cfg, port=0)
+    server.endpoint = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
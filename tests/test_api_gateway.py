@@ -0,0 +1,118 @@
+import threading
+import time
+
+import pytest
+
+from api_gateway import (APIGateway, RateBudget, CANCEL, PLACE, PRIVATE_READ,
+                         PUBLIC_READ)
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def test_budget_serves_waiters_by_priority():
+    # one token a quarter second, already spent, so everyone queues
+    budget = RateBudget(rate=4, burst=1)
+    budget.acquire(PUBLIC_READ)
+    served = []
+
+    def take(priority):
+        budget.acquire(priority)
+        served.append(priority)
+
+    threads = []
+    for priority in (PUBLIC_READ, PRIVATE_READ, PLACE, CANCEL):
+        t = threading.Thread(target=take, args=(priority,))
+        t.start()
+        threads.append(t)
+        wait_for(lambda: len(budget.waiters) == len(threads))
+    for t in threads:
+        t.join(5)
+    assert served == [CANCEL, PLACE, PRIVATE_READ, PUBLIC_READ]
+
+
+class SlowAPI:
+    """ Holds every get until `go` is set, counting the ones that reach it """
+
+    def __init__(self):
+        self.go = threading.Event()
+        self.calls = 0
+        self.error = None
+
+    def get(self, endpoint, **kwargs):
+        self.calls += 1
+        self.go.wait(5)
+        if self.error is not None:
+            raise self.error
+        return {'orders': [{'id': 1}]}
+
+
+def gateway(api):
+    return APIGateway(api, {'rate_limit': 1000, 'burst': 1000,
+                            'report_period': 60})
+
+
+def in_threads(n, fn):
+    results = [None] * n
+    errors = [None] * n
+
+    def run(i):
+        try:
+            results[i] = fn()
+        except Exception as e:
+            errors[i] = e
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    return threads, results, errors
+
+
+def test_identical_reads_in_flight_are_coalesced():
+    api = SlowAPI()
+    gw = gateway(api)
+    threads, results, _ = in_threads(3, lambda: gw.get('/v1/user/orders'))
+    threads[0].start()
+    wait_for(lambda: api.calls == 1)
+    for t in threads[1:]:
+        t.start()
+    wait_for(lambda: gw.stats[PRIVATE_READ].coalesced == 2)
+    api.go.set()
+    for t in threads:
+        t.join(5)
+
+    assert api.calls == 1
+    assert results == [{'orders': [{'id': 1}]}] * 3
+    # each caller gets its own copy to mutate
+    results[1]['orders'].clear()
+    assert results[2]['orders'] == [{'id': 1}]
+
+
+def test_coalesced_callers_share_the_error():
+    api = SlowAPI()
+    api.error = RuntimeError("boom")
+    gw = gateway(api)
+    threads, _, errors = in_threads(2, lambda: gw.get('/v1/user/orders'))
+    threads[0].start()
+    wait_for(lambda: api.calls == 1)
+    threads[1].start()
+    wait_for(lambda: gw.stats[PRIVATE_READ].coalesced == 1)
+    api.go.set()
+    for t in threads:
+        t.join(5)
+    assert [str(e) for e in errors] == ["boom", "boom"]
+    # nothing is left in flight, so the next read goes out again
+    api.error = None
+    assert gw.get('/v1/user/orders') == {'orders': [{'id': 1}]}
+    assert api.calls == 2
+
+
+@pytest.mark.parametrize('method, endpoint, priority', [
+    ('get', '/v1/ticker/DOGE_BTC', PUBLIC_READ),
+    ('get', '/v1/user/orders', PRIVATE_READ),
+    ('post', '/v1/user/buy_limit', PLACE),
+    ('post', '/v1/user/cancel_order', CANCEL),
+])
+def test_classify(method, endpoint, priority):
+    assert APIGateway.classify(method, endpoint) == priority
@@ -0,0 +1,77 @@
+import json
+import urllib.error
+import urllib.request
+from decimal import Decimal
+
+import exchange_sim
+
+
+def call(server, method, path, body=None):
+    """ (status, payload) of one request to the simulator """
+    data = None if body is None else json.dumps(body).encode()
+    req = urllib.request.Request(server.endpoint + path, data=data, method=method)
+    try:
+        with urllib.request.urlopen(req) as resp:
+            return resp.status, json.load(resp)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def balances(server):
+    _, payload = call(server, 'GET', '/v1/user/balances_all')
+    return ({b['currency']: Decimal(b['balance']) for b in payload['data']['balances']},
+            {b['currency']: Decimal(b['balance']) for b in payload['data']['order_balances']})
+
+
+def test_resting_order_holds_funds_until_cancelled(sim):
+    free, held = balances(sim)
+    status, payload = call(sim, 'POST', '/v1/user/buy_limit', {
+        'market_id': 1, 'price': '0.00000030', 'value': '0.003'})
+    assert status == 200
+    order = payload['data']['order']
+    assert order['open'] and order['market_amount'] == '10000.00000000'
+
+    free_after, held_after = balances(sim)
+    assert free_after['BTC'] == free['BTC'] - Decimal('0.003')
+    assert held_after['BTC'] == held.get('BTC', 0) + Decimal('0.003')
+
+    status, _ = call(sim, 'POST', '/v1/user/cancel_order', {'id': order['id']})
+    assert status == 200
+    assert balances(sim)[0]['BTC'] == free['BTC']
+    # a second cancel is refused, like the real API does
+    status, payload = call(sim, 'POST', '/v1/user/cancel_order', {'id': order['id']})
+    assert status == 400
+    assert payload['errors'][0]['code'] == 'order_not_open'
+
+
+def test_crossing_order_fills_resting_one(sim):
+    _, payload = call(sim, 'POST', '/v1/user/sell_limit', {
+        'market_id': 1, 'price': '0.00000035', 'amount': '1000'})
+    sell = payload['data']['order']
+    status, payload = call(sim, 'POST', '/v1/user/buy_limit', {
+        'market_id': 1, 'price': '0.00000036', 'amount': '400'})
+    assert status == 200
+    buy = payload['data']['order']
+    assert not buy['open']
+    # the taker pays the resting order's price
+    assert buy['trades'][0]['price'] == '0.00000035'
+
+    _, payload = call(sim, 'GET', '/v1/user/order/{}'.format(sell['id']))
+    assert payload['data']['order']['market_amount_remaining'] == '600.00000000'
+    _, payload = call(sim, 'GET', '/v1/user/trades')
+    assert [t['taker'] for t in payload['data']['trades']] == [False, True]
+
+
+def test_prevent_taker_rejects_crossing_order(sim):
+    call(sim, 'POST', '/v1/user/sell_limit', {
+        'market_id': 1, 'price': '0.00000035', 'amount': '1000'})
+    status, payload = call(sim, 'POST', '/v1/user/buy_limit', {
+        'market_id': 1, 'price': '0.00000035', 'amount': '10',
+        'prevent_taker': True})
+    assert status == 400
+    assert payload['errors'][0]['code'] == 'prevent_taker'
+
+
+def test_rate_limiter_refuses_over_budget():
+    limiter = exchange_sim.RateLimiter(rate=0.001, burst=2)
+    assert [limiter.allow() for _ in range(3)] == [True, True, False]
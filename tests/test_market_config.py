@@ -0,0 +1,50 @@
+from decimal import Decimal
+
+import pytest
+
+from market_config import ConfigError, OrderbookConfig
+
+
+def obm_config(config):
+    return config['orderbook_manager']
+
+
+def test_shipped_config_compiles(config):
+    c = OrderbookConfig.compile(obm_config(config))
+    doge = c.markets['DOGE_BTC']
+    assert (doge.market_currency, doge.base_currency) == ('DOGE', 'BTC')
+    # parsed through str, so .25 is exactly a quarter
+    assert doge.allocations['BTC'] == Decimal('0.25')
+    # the default ladder is merged in, nearest slip first
+    slips = [slip for slip, _ in doge.buy_ladder]
+    assert slips == sorted(slips) and slips
+    assert 'default' not in c.markets
+
+
+def test_compiled_config_is_read_only(config):
+    c = OrderbookConfig.compile(obm_config(config))
+    with pytest.raises(TypeError):
+        c.markets['XYZ_BTC'] = None
+    with pytest.raises(AttributeError):
+        c.dry_run_mode = False
+
+
+@pytest.mark.parametrize('change, message', [
+    (lambda raw: raw['markets']['DOGE_BTC'].pop('DOGE'), "has no DOGE allocation"),
+    (lambda raw: raw['markets'].update(DOGEBTC={}), "MARKET_BASE"),
+    (lambda raw: raw['currency_reserves'].pop('LTC'), "no currency reserve"),
+    (lambda raw: raw['markets']['NANO_BTC'].update(BTC=.5), "BTC allocations add up"),
+    (lambda raw: raw['markets']['DOGE_BTC'].update(DOGE=1.5), "at most 1"),
+    (lambda raw: raw['markets']['LTC_BTC']['intervals']['sell_limit'].update({0.3: .5}),
+     "ratios add up to more than 1"),
+    (lambda raw: raw['markets']['LTC_BTC']['intervals'].pop('buy_limit'),
+     "has no buy_limit intervals"),
+    (lambda raw: raw.update(price_tolerance='lots'), "must be a number"),
+    (lambda raw: raw.update(dry_run_mode='yes'), "true or false"),
+    (lambda raw: raw.pop('monitor_period'), "Missing orderbook_manager setting"),
+])
+def test_invalid_config_is_rejected(config, change, message):
+    raw = obm_config(config)
+    change(raw)
+    with pytest.raises(ConfigError, match=message):
+        OrderbookConfig.compile(raw)
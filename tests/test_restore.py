@@ -0,0 +1,80 @@
+import pytest
+
+pytest.importorskip('qtrade_client')
+
+from main import make_components  # noqa: E402
+
+
+@pytest.fixture
+def bot(sim, config, tmp_path):
+    """ Builds a fresh set of components against the simulator, as a
+    restarted bot would; the first one scrapes the tickers every bot quotes
+    around, before our own orders are in the book to move them. """
+    obm = config['orderbook_manager']
+    obm.update(dry_run_mode=False, state_path=str(tmp_path / 'obm_state.json'),
+               # the shipped allocations leave part of every balance free,
+               # which would have the reserve check requote each cycle
+               reserve_thresh_usd=1000000)
+    config['journal']['path'] = str(tmp_path / 'journal.ndjson')
+    config['api_gateway'].update(rate_limit=10000, burst=10000)
+    config['market_data_collector']['scrapers'] = {'qtrade': {'markets': {
+        m: m for m in obm['markets'] if m != 'default'}}}
+    built = []
+
+    def build():
+        c = make_components(config, sim.endpoint, '1:testkey')
+        if not built:
+            c['mdc'].update_tickers()
+            c['mdc'].update_midpoints()
+        built.append(c)
+        c['obm'].start()
+        return c['obm']
+    yield build
+    for c in built:
+        c['journal'].close()
+
+
+def resting(sim):
+    """ {market: set of open order ids} on the simulator """
+    with sim.sim.lock:
+        ids = {}
+        for o in sim.sim.orders.values():
+            if o.open:
+                ids.setdefault(o.market.market_string, set()).add(o.id)
+        return ids
+
+
+def test_warm_restart_keeps_resting_orders(sim, bot):
+    bot().cycle()
+    before = resting(sim)
+    assert set(before) == {'DOGE_BTC', 'LTC_BTC', 'NANO_BTC', 'ETH_BTC'}
+
+    restarted = bot()
+    assert set(restarted.prev_alloc_profile) == set(before)
+    restarted.cycle()
+    assert resting(sim) == before
+
+
+def test_restart_requotes_only_markets_that_changed(sim, bot):
+    bot().cycle()
+    before = resting(sim)
+    with sim.sim.lock:
+        sim.sim.cancel_order(min(before['LTC_BTC']))
+
+    restarted = bot()
+    assert 'LTC_BTC' not in restarted.prev_alloc_profile
+    restarted.cycle()
+    after = resting(sim)
+    assert after['LTC_BTC'].isdisjoint(before['LTC_BTC'])
+    assert len(after['LTC_BTC']) == len(before['LTC_BTC'])
+    for market in ('DOGE_BTC', 'NANO_BTC', 'ETH_BTC'):
+        assert after[market] == before[market]
+
+
+def test_unreadable_checkpoint_is_a_cold_start(sim, bot, config):
+    with open(config['orderbook_manager']['state_path'], 'w') as f:
+        f.write('{"prev_alloc_')
+    obm = bot()
+    assert obm.prev_alloc_profile == {}
+    obm.cycle()
+    assert set(resting(sim)) == {'DOGE_BTC', 'LTC_BTC', 'NANO_BTC', 'ETH_BTC'}
@@ -0,0 +1,109 @@
+from decimal import Decimal
+
+import pytest
+
+from conversion import ConversionGraph
+from market_config import ConfigError
+from records import Order, Ticker, to_sats
+from risk import ExposureLedger, RiskLimits, RiskManager, RiskRejected
+
+
+@pytest.fixture
+def rates():
+    rates = ConversionGraph()
+    rates.on_ticker('test', 'ETH_BTC', Ticker.from_prices('0.02', '0.02', '0.02'))
+    rates.refresh()
+    return rates
+
+
+def order(id, order_type, price, amount):
+    return Order(id, 1, order_type, to_sats(price), to_sats(amount))
+
+
+def book(*orders):
+    sides = {'buy': [], 'sell': []}
+    for o in orders:
+        sides['buy' if o.order_type == 'buy_limit' else 'sell'].append(o)
+    return sides
+
+
+def test_sync_totals_open_orders(rates):
+    ledger = ExposureLedger(rates)
+    ledger.sync({
+        'DOGE_BTC': book(order(1, 'buy_limit', '0.00000030', '10000'),
+                         order(2, 'sell_limit', '0.00000040', '5000')),
+        'XYZ_ETH': book(order(3, 'buy_limit', '0.5', '2')),
+    })
+    base, market, notional = ledger.markets['DOGE_BTC']
+    assert (base, market, notional) == (Decimal('0.003'), Decimal('5000'), Decimal('0.005'))
+    assert ledger.currencies == {'BTC': Decimal('0.003'), 'DOGE': Decimal('5000'),
+                                 'ETH': Decimal('1'), 'XYZ': 0}
+    # XYZ_ETH's 1 ETH is valued in BTC through the conversion graph
+    assert ledger.markets['XYZ_ETH'][2] == Decimal('0.02')
+    assert ledger.total_notional_btc == Decimal('0.025')
+
+
+def test_release_only_takes_out_what_is_still_counted(rates):
+    risk = RiskManager({}, rates=rates)
+    risk.record('buy_limit', 'DOGE_BTC', '0.0000003', '0.003', order_id=7)
+    assert risk.ledger.currencies['BTC'] == Decimal('0.003')
+    assert risk.release(7)
+    assert risk.ledger.currencies['BTC'] == 0
+    assert not risk.release(7)
+
+    # a sync rebuilt the ledger from the exchange after the order was
+    # recorded, so releasing it would count it out twice
+    risk.record('buy_limit', 'DOGE_BTC', '0.0000003', '0.003', order_id=8)
+    risk.sync({'DOGE_BTC': book(order(8, 'buy_limit', '0.00000030', '10000'))})
+    assert not risk.release(8)
+    assert risk.ledger.currencies['BTC'] == Decimal('0.003')
+
+
+def test_check_reads_the_ledger(rates):
+    risk = RiskManager({'max_market_notional_btc': 0.01,
+                        'max_currency_exposure': {'DOGE': 1000}}, rates=rates)
+    risk.check('buy_limit', 'DOGE_BTC', '0.0000003', '0.008')
+    risk.record('buy_limit', 'DOGE_BTC', '0.0000003', '0.008')
+    with pytest.raises(RiskRejected, match="DOGE_BTC notional"):
+        risk.check('buy_limit', 'DOGE_BTC', '0.0000003', '0.003')
+    with pytest.raises(RiskRejected, match="DOGE would be committed"):
+        risk.check('sell', 'DOGE_BTC', '0.0000004', '1500')
+    # other markets have room of their own
+    risk.check('buy_limit', 'LTC_BTC', '0.006', '0.008')
+    risk.clear_market('DOGE_BTC')
+    risk.check('buy_limit', 'DOGE_BTC', '0.0000003', '0.003')
+    assert risk.rejected == 2
+
+
+def test_order_rate_limit():
+    risk = RiskManager({'max_orders_per_sec': 2})
+    for now in (0, 0.5):
+        risk.check('buy_limit', 'DOGE_BTC', '0.0000003', '0.001', now=now)
+        risk.record('buy_limit', 'DOGE_BTC', '0.0000003', '0.001', now=now)
+    with pytest.raises(RiskRejected, match="orders in the last second"):
+        risk.check('buy_limit', 'DOGE_BTC', '0.0000003', '0.001', now=0.9)
+    risk.check('buy_limit', 'DOGE_BTC', '0.0000003', '0.001', now=1.1)
+
+
+def test_fractional_order_rate_is_refused():
+    with pytest.raises(ConfigError, match="at least 1"):
+        RiskLimits.compile({'max_orders_per_sec': 0.5})
+
+
+def test_check_ladders_replaces_resting_exposure_and_accumulates(rates):
+    risk = RiskManager({'max_market_notional_btc': 0.01,
+                        'max_total_notional_btc': 0.015}, rates=rates)
+    risk.record('buy_limit', 'DOGE_BTC', '0.0000003', '0.008')
+    ladders = {
+        # replaces the 0.008 resting on DOGE_BTC rather than adding to it
+        'DOGE_BTC': [('buy_limit', '0.0000003', '0.004'),
+                     ('buy_limit', '0.0000002', '0.004')],
+        # fine on its own, but not on top of DOGE_BTC's new ladder
+        'LTC_BTC': [('buy_limit', '0.006', '0.008')],
+        'NANO_BTC': [('buy_limit', '0.0001', '0.006')],
+    }
+    held = risk.check_ladders(ladders)
+    assert list(held) == ['LTC_BTC']
+    assert "total notional" in held['LTC_BTC']
+    # nothing is recorded by checking
+    assert risk.ledger.total_notional_btc == Decimal('0.008')
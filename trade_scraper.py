@@ -1,26 +1,29 @@
 from qtrade_client.api import QtradeAPI
+from records import Trade
 import json
+import sys
 
 def scrape_trades(api):
-    trades = api.get('/v1/user/trades')["trades"]
+    trades = [Trade.parse(t) for t in api.get('/v1/user/trades')["trades"]]
 
-    while True:
-        new_trades = api.get('/v1/user/trades', newer_than=trades[-1]["id"])["trades"]
+    while trades:
+        new_trades = api.get('/v1/user/trades', newer_than=trades[-1].id)["trades"]
 
         if len(new_trades) == 0:
             break
 
-        trades += new_trades
+        trades += [Trade.parse(t) for t in new_trades]
 
     return trades
 
 if __name__ == "__main__":
     hmac = open("lpbot_hmac.txt").read().strip()
 
-    api = QtradeAPI("https://api.qtrade.io", key=hmac)
+    endpoint = sys.argv[1] if len(sys.argv) > 1 else "https://api.qtrade.io"
+    api = QtradeAPI(endpoint, key=hmac)
 
     trades = scrape_trades(api)
 
     f = open("trades.json", "w")
-    f.write(json.dumps(trades))
+    f.write(json.dumps([t.to_json() for t in trades]))
     f.close()
\ No newline at end of file
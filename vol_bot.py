@@ -2,11 +2,13 @@ import numpy as np
 import time
 import logging
 import asyncio
+import functools
 
 from collections import namedtuple
 from decimal import Decimal
 
 from qtrade_client.api import APIException
+from risk import RiskManager, RiskRejected
 
 log = logging.getLogger('vol')
 
@@ -17,9 +19,11 @@ class Trade(namedtuple('Trade', ['time_until', 'curr_code', 'perc', 'side'])):
 
 
 class VolBot:
-    def __init__(self, config, api):
+    def __init__(self, config, api, risk=None):
         self.data_series = []
         self.api = api
+        # shared with the orderbook manager so limits cover both bots
+        self.risk = risk or RiskManager({})
         self.config = config['vol_bot_manager']
         self.q = self.config['default']['q']
         self.var = self.config['default']['var']
@@ -37,6 +41,12 @@ class VolBot:
             return
         await asyncio.sleep(time)
 
+    async def in_thread(self, fn, *args, **kwargs):
+        """ Run a blocking API call on a worker thread, so waiting on the
+        gateway's rate budget doesn't stall the event loop """
+        return await asyncio.get_event_loop().run_in_executor(
+            None, functools.partial(fn, *args, **kwargs))
+
     def compute_allocations(self):
         '''
         Accepts:
@@ -193,6 +203,8 @@ class VolBot:
             log.debug("Attempted to place order for negative quantity")
             return
 
+        self.risk.check(order_type, market_string, price, quantity)
+
         log.debug("Placing %s on %s market for %s at %s",
                   order_type, market_string, quantity, price)
         if order_type == 'buy':
@@ -201,9 +213,12 @@ class VolBot:
         elif order_type == 'sell':
             value = None
             amount = quantity
-        return self.api.order(
+        order = self.api.order(
             order_type, price, market_string=market_string, value=value,
             amount=amount, prevent_taker=False)['data']['order']
+        self.risk.record(order_type, market_string, price, quantity,
+                         order_id=order['id'])
+        return order
 
     async def generate_series(self):
         if self.dry is True:
@@ -230,23 +245,28 @@ class VolBot:
             await self.sleep(sleep_time)
             log.debug(f"Finished sleeping for {sleep_time:.2f}")
 
-            amounts = self.compute_allocations()
-            if not self.check_orderbook(trade):
+            amounts = await self.in_thread(self.compute_allocations)
+            if not await self.in_thread(self.check_orderbook, trade):
                 # not first on order book
                 log.info('Not first on the book for %s', trade)
                 continue
 
             price, quantity = self.price_trade(trade, amounts)
             usd_value = round(self.btc_price * float(price) * float(quantity), 2)
-            # need to change string to market_string
             if self.dry is True:
                 # dry run
                 log.info(f"Would've exec {trade} of {quantity:.4f} {trade.curr_code} @ {price} (${usd_value})")
                 continue
 
             log.info(f"Placing order to exec {trade} of {quantity:.4f} {trade.curr_code} @ {price} (${usd_value})")
+            market_string = f'{trade.curr_code}_BTC'
+            quantity = round(float(quantity), 6)
             try:
-                new_order = self.place_order(trade.side, trade.curr_code, price, round(float(quantity), 6))
+                new_order = await self.in_thread(
+                    self.place_order, trade.side, market_string, price, quantity)
+            except RiskRejected as e:
+                log.warning(f"Risk check rejected {trade}: {e}")
+                continue
             except Exception:
                 log.warn("Unknown error placing order", exc_info=True)
                 continue
@@ -256,13 +276,17 @@ class VolBot:
 
             # Fill or Kill - move to a different function once it works
             await asyncio.sleep(1)
-            res = self.api.get(f"/v1/user/order/{new_order['id']}")
+            res = await self.in_thread(
+                self.api.get, f"/v1/user/order/{new_order['id']}")
             if res['open'] == 'true':
                 # Kill
-                self.api.post('/v1/user/cancel_order', json={'id': new_order['id']})
+                await self.in_thread(self.api.post, '/v1/user/cancel_order',
+                                     json={'id': new_order['id']})
             else:
                 # Fill
                 pass
+            # either way it's no longer resting
+            self.risk.release(new_order['id'])
 
     async def run(self):
         strt_time = time.time()